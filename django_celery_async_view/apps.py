@@ -0,0 +1,12 @@
+# -*- coding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+from django.apps import AppConfig
+
+
+class DjangoCeleryAsyncViewConfig(AppConfig):
+    name = 'django_celery_async_view'
+
+    def ready(self):
+        # connects celery signals
+        import django_celery_async_view.notifications  # noqa: F401
@@ -0,0 +1,427 @@
+# -*- coding: utf-8
+"""
+Native async (ASGI) versions of the views.
+Requires Python 3 and Django >= 4.2 (async class-based views
+and StreamingHttpResponse with async iterators).
+
+Waiting does not reserve a thread:
+    - result backend calls (ready(), get()) run in a dedicated thread pool
+      of settings.ASYNC_VIEW_RESULT_BACKEND_THREADS threads
+    - database access in Phase 2. (cancel, leases, progress and the result
+      backends storing results in the database) runs in sync_to_async in a
+      thread pool of settings.ASYNC_VIEW_DATABASE_THREADS threads and
+      the connections are closed like at the end of a request
+    - long polling and Server-Sent Events wait for the completion event of
+      settings.ASYNC_VIEW_NOTIFICATION_BACKEND (RedisNotificationBackend: one
+      subscription per process), without it the result backend is polled
+      with growing intervals (long_poll_interval ... long_poll_max_interval)
+    - database access (Phase 1. and Phase 3.) runs in sync_to_async
+    - streamed content is read chunk by chunk in sync_to_async
+"""
+from __future__ import absolute_import, unicode_literals
+import asyncio
+import functools
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponseBadRequest, HttpResponseNotAllowed, StreamingHttpResponse
+from django.utils.module_loading import import_string
+
+from django_celery_async_view.notifications import get_notification_backend
+from django_celery_async_view.views import AbstractAsyncView, AsyncDownloadView
+
+if django.VERSION < (4, 2):
+    raise ImportError('django_celery_async_view.asgi_views requires Django >= 4.2')
+
+DEFAULT_RESULT_BACKEND_THREADS = 20
+DEFAULT_DATABASE_THREADS = 20
+# result backends storing the results in the django database
+DATABASE_RESULT_BACKEND_MODULES = ('djcelery.', 'django_celery_results.')
+# threads of ExecutorNotificationWaiter, one per waiting request
+DEFAULT_NOTIFICATION_THREADS = 100
+
+_result_backend_executor = None
+_result_backend_executor_lock = threading.Lock()
+_database_executor = None
+_database_executor_lock = threading.Lock()
+
+# event loop: {notification backend: waiter}
+_notification_waiters = weakref.WeakKeyDictionary()
+
+# returned by next() when the iterator is exhausted
+_STOP = object()
+
+
+def get_result_backend_executor():
+    """
+    :return: thread pool for blocking result backend calls
+    """
+    global _result_backend_executor
+    if _result_backend_executor is None:
+        with _result_backend_executor_lock:
+            if _result_backend_executor is None:
+                _result_backend_executor = ThreadPoolExecutor(
+                    max_workers=getattr(
+                        settings, 'ASYNC_VIEW_RESULT_BACKEND_THREADS',
+                        DEFAULT_RESULT_BACKEND_THREADS),
+                    thread_name_prefix='async-view-result-backend')
+    return _result_backend_executor
+
+
+async def run_in_result_backend_executor(func, *args, **kwargs):
+    """
+    Runs blocking result backend call without blocking the event loop.
+    Not for database access, see run_in_database_executor().
+    :param func: e.g. result.ready
+    :return: func return value
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_result_backend_executor(), functools.partial(func, *args, **kwargs))
+
+
+def get_database_executor():
+    """
+    :return: thread pool for blocking database access
+    """
+    global _database_executor
+    if _database_executor is None:
+        with _database_executor_lock:
+            if _database_executor is None:
+                _database_executor = ThreadPoolExecutor(
+                    max_workers=getattr(
+                        settings, 'ASYNC_VIEW_DATABASE_THREADS', DEFAULT_DATABASE_THREADS),
+                    thread_name_prefix='async-view-database')
+    return _database_executor
+
+
+def _call_closing_connections(func, *args, **kwargs):
+    # like request_started and request_finished
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_in_database_executor(func, *args, **kwargs):
+    """
+    Runs blocking database access without blocking the event loop.
+    Old connections of the thread are closed before and after the call.
+    :param func: e.g. view.cancel_response
+    :return: func return value
+    """
+    return await sync_to_async(
+        _call_closing_connections, thread_sensitive=False,
+        executor=get_database_executor())(func, *args, **kwargs)
+
+
+def is_database_result_backend(backend):
+    """
+    :param backend: celery result backend
+    :return: True if the results are stored in the django database
+    """
+    return type(backend).__module__.startswith(DATABASE_RESULT_BACKEND_MODULES)
+
+
+async def run_result_backend_call(result, func, *args, **kwargs):
+    """
+    Runs result backend call in the database executor if the backend
+    uses the django database, else in the result backend executor.
+    :param result: AsyncResult
+    :param func: e.g. result.ready
+    :return: func return value
+    """
+    if is_database_result_backend(result.backend):
+        return await run_in_database_executor(func, *args, **kwargs)
+    return await run_in_result_backend_executor(func, *args, **kwargs)
+
+
+class ExecutorNotificationWaiter(object):
+    """
+    Calls the blocking wait() of the notification backend in a thread pool
+    of settings.ASYNC_VIEW_NOTIFICATION_THREADS threads.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.executor = ThreadPoolExecutor(
+            max_workers=getattr(
+                settings, 'ASYNC_VIEW_NOTIFICATION_THREADS', DEFAULT_NOTIFICATION_THREADS),
+            thread_name_prefix='async-view-notification')
+
+    async def wait(self, task_id, timeout):
+        """
+        :param task_id:
+        :param timeout: seconds
+        :return: event or None if timeout
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self.backend.wait, task_id, timeout)
+
+
+class AsyncRedisNotificationWaiter(object):
+    """
+    Waits for the events of RedisNotificationBackend in the event loop.
+    One pattern subscription dispatches the events to all waiting requests,
+    so the number of waiting requests does not add redis connections.
+    If the subscription fails the waiting requests time out
+    and the next wait subscribes again.
+    Requires redis >= 4.2 (redis.asyncio).
+    """
+
+    def __init__(self, backend):
+        import redis.asyncio
+        self.key_prefix = backend.key_prefix
+        self.client = redis.asyncio.StrictRedis.from_url(backend.url)
+        # task_id: futures of the waiting requests
+        self._waiters = {}
+        self._subscribed = None
+
+    async def wait(self, task_id, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        future = loop.create_future()
+        self._waiters.setdefault(task_id, set()).add(future)
+        try:
+            await asyncio.wait_for(self._subscribe(), timeout)
+            # published before subscribe
+            event = await self.client.get(self.key_prefix + task_id)
+            if event is None:
+                event = await asyncio.wait_for(future, max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            waiters = self._waiters[task_id]
+            waiters.discard(future)
+            if not waiters:
+                del self._waiters[task_id]
+        return event.decode('utf-8') if isinstance(event, bytes) else event
+
+    async def _subscribe(self):
+        if self._subscribed is None:
+            self._subscribed = asyncio.get_running_loop().create_future()
+            asyncio.ensure_future(self._listen(self._subscribed))
+        # shield: a timed out request does not cancel the subscription
+        await asyncio.shield(self._subscribed)
+
+    async def _listen(self, subscribed):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.psubscribe(self.key_prefix + '*')
+            subscribed.set_result(True)
+            async for message in pubsub.listen():
+                channel = message['channel']
+                if isinstance(channel, bytes):
+                    channel = channel.decode('utf-8')
+                for future in self._waiters.get(channel[len(self.key_prefix):], ()):
+                    if not future.done():
+                        future.set_result(message['data'])
+        except Exception as e:
+            if not subscribed.done():
+                subscribed.set_exception(e)
+        finally:
+            self._subscribed = None
+            await pubsub.close()
+
+
+def get_notification_waiter(backend):
+    """
+    :param backend: notification backend
+    :return: waiter of the backend for the running event loop
+        (backend.async_waiter_class or ExecutorNotificationWaiter)
+    """
+    waiters = _notification_waiters.setdefault(asyncio.get_running_loop(), {})
+    if backend not in waiters:
+        waiter_class = ExecutorNotificationWaiter
+        if backend.async_waiter_class is not None:
+            waiter_class = import_string(backend.async_waiter_class)
+        waiters[backend] = waiter_class(backend)
+    return waiters[backend]
+
+
+async def aiter_in_thread(iterator):
+    """
+    Async iterator over sync iterator (e.g. streamed TempFile content).
+    Each chunk is read in sync_to_async so the database access
+    stays in the same thread.
+    :param iterator:
+    :return:
+    """
+    iterator = iter(iterator)
+    _next = sync_to_async(next)
+    while True:
+        chunk = await _next(iterator, _STOP)
+        if chunk is _STOP:
+            return
+        yield chunk
+
+
+class _AsgiViewMixin(object):
+
+    async def post(self, request):
+        """
+        Phase 2. Cancel (JsonResponse)
+        :param request:
+        :return:
+        """
+        task_id = request.GET.get('task_id')
+        if task_id is None or not self.is_cancel(request):
+            return HttpResponseBadRequest()
+        return await run_in_database_executor(
+            self.cancel_response, self.task.AsyncResult(task_id))
+
+    async def async_ready(self, result):
+        return await run_result_backend_call(result, result.ready)
+
+    async def async_wait_until_ready(self, result, timeout):
+        """
+        Phase 2. long polling / Server-Sent Events
+        Waits until the task is ready or timeout has passed.
+        :param result: AsyncResult
+        :param timeout: seconds
+        :return: is the task ready
+        """
+        if await self.async_ready(result):
+            return True
+        notification_backend = get_notification_backend()
+        if notification_backend is not None:
+            # published after the result is stored
+            event = await get_notification_waiter(notification_backend).wait(
+                result.id, timeout)
+            return event is not None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        interval = self.long_poll_interval
+        while loop.time() < deadline:
+            await asyncio.sleep(min(interval, max(deadline - loop.time(), 0)))
+            if await self.async_ready(result):
+                return True
+            interval = min(interval * self.long_poll_backoff, self.long_poll_max_interval)
+        return False
+
+    def event_stream_response(self, result):
+        """
+        Phase 2. Server-Sent Events
+        ASYNC_VIEW_NOTIFICATION_BACKEND is not required, see async_wait_until_ready().
+        :param result: AsyncResult
+        :return:
+        """
+        response = StreamingHttpResponse(
+            self.aiter_task_events(result),
+            content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # nginx must not buffer the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def aiter_task_events(self, result):
+        # reconnect after 1s if the stream is closed
+        yield 'retry: 1000\n\n'
+        if await self.async_wait_until_ready(result, self.event_stream_timeout):
+            yield 'event: ready\ndata: {"ready": true}\n\n'
+
+    async def async_phase2_ready(self, request, result):
+        """
+        Phase 2.
+        :param request:
+        :param result: AsyncResult
+        :return: is the task ready
+        """
+        if self.is_long_poll(request):
+            return await self.async_wait_until_ready(result, self.long_poll_timeout)
+        return await self.async_ready(result)
+
+
+class AsgiAbstractAsyncView(_AsgiViewMixin, AbstractAsyncView):
+    """
+    async def get() version of AbstractAsyncView.
+    Same options as AbstractAsyncView.
+    """
+
+    async def get(self, request):
+        if self.eager:
+            return await sync_to_async(self.eager_response)(request)
+        if self.task is None:
+            raise ValueError('Define task. task should be celery task.')
+
+        task_id = request.GET.get('task_id')
+
+        if task_id is None:
+            # Phase 1. Loading page
+            return await sync_to_async(self.no_task_id)(request)
+
+        if self.is_cancel(request):
+            # Phase 2. Cancel is POST only
+            return HttpResponseNotAllowed(['POST'])
+        result = self.task.AsyncResult(task_id)
+        await run_in_database_executor(self.renew_lease, request, task_id)
+        if self.is_event_stream(request):
+            # Phase 2. Server-Sent Events
+            return self.event_stream_response(result)
+        if not await self.async_phase2_ready(request, result):
+            # Phase 2. Not ready (JsonResponse)
+            return await run_in_database_executor(self.not_ready_response, result)
+        # Phase 3. Ready+Html (JsonResponse)
+        result = await run_result_backend_call(result, result.get)
+        return await sync_to_async(self.create_task_html_response)(result, task_id)
+
+
+class AsgiAsyncDownloadView(_AsgiViewMixin, AsyncDownloadView):
+    """
+    async def get() version of AsyncDownloadView.
+    Same options as AsyncDownloadView.
+    """
+
+    async def get(self, request):
+        if self.eager:
+            response = await sync_to_async(self.eager_response)(request)
+            return self.async_file_response(response)
+
+        if self.task is None:
+            raise ValueError(
+                'Define task. '
+                'Task should be celery task extending AbstractAsyncDownloadTask.')
+
+        task_id = request.GET.get('task_id')
+        download = self.get_bool_param(request, 'download')
+
+        if task_id is None:
+            # Phase 1.
+            return await sync_to_async(self.no_task_id)(request)
+
+        if self.is_cancel(request):
+            # Phase 2. Cancel is POST only
+            return HttpResponseNotAllowed(['POST'])
+        result = self.task.AsyncResult(task_id)
+        if not download:
+            # Phase 2.
+            await run_in_database_executor(self.renew_lease, request, task_id)
+            if self.is_event_stream(request):
+                return self.event_stream_response(result)
+            await self.async_phase2_ready(request, result)
+            return await run_in_database_executor(self.is_file_ready, result)
+        else:
+            # Phase 3.
+            result = await run_result_backend_call(result, result.get)
+            response = await sync_to_async(self.get_file_response)(result)
+            return self.async_file_response(response)
+
+    def async_file_response(self, response):
+        """
+        Phase 3.
+        Streamed content is read in sync_to_async chunk by chunk.
+        :param response: get_file_response() response
+        :return:
+        """
+        is_sync_stream = isinstance(response, StreamingHttpResponse) and not response.is_async
+        if is_sync_stream:
+            # FileResponse and StreamingHttpResponse over sync generator
+            response.streaming_content = aiter_in_thread(response.streaming_content)
+        return response
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+
+DEFAULT_CACHE_ALIAS = 'default'
+
+KEY_PREFIX = 'django_celery_async_view'
+
+
+def get_cache():
+    """
+    Must be shared by all web processes e.g. redis or memcached.
+    :return: cache defined in settings.ASYNC_VIEW_CACHE_ALIAS
+    """
+    return caches[getattr(settings, 'ASYNC_VIEW_CACHE_ALIAS', DEFAULT_CACHE_ALIAS)]
+
+
+def make_key(namespace, *parts):
+    """
+    Stable key from json serializable parts.
+    :param namespace: e.g. 'dedup'
+    :param parts:
+    :return:
+    """
+    serialized = json.dumps(parts, sort_keys=True, cls=DjangoJSONEncoder)
+    digest = hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+    return '{}:{}:{}'.format(KEY_PREFIX, namespace, digest)
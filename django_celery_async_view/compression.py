@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+import zlib
+
+# HTTP Content-Encoding values
+GZIP = 'gzip'
+# zlib format (RFC 1950), HTTP "deflate"
+DEFLATE = 'deflate'
+
+_WBITS = {
+    GZIP: 16 + zlib.MAX_WBITS,
+    DEFLATE: zlib.MAX_WBITS,
+}
+
+DEFAULT_COMPRESSION_LEVEL = 6
+
+
+def _get_wbits(encoding):
+    try:
+        return _WBITS[encoding]
+    except KeyError:
+        raise ValueError('Unsupported content encoding {!r}'.format(encoding))
+
+
+def iter_compressed(chunks, encoding, level=DEFAULT_COMPRESSION_LEVEL):
+    """
+    Compresses incrementally.
+    :param chunks: iterable of bytes
+    :param encoding: GZIP or DEFLATE
+    :param level: zlib compression level
+    :return: generator of compressed chunks
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, _get_wbits(encoding))
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def iter_decompressed(chunks, encoding):
+    """
+    Decompresses incrementally.
+    :param chunks: iterable of compressed bytes
+    :param encoding: GZIP or DEFLATE
+    :return: generator of decompressed chunks
+    """
+    decompressor = zlib.decompressobj(_get_wbits(encoding))
+    for chunk in chunks:
+        decompressed = decompressor.decompress(chunk)
+        if decompressed:
+            yield decompressed
+    decompressed = decompressor.flush()
+    if decompressed:
+        yield decompressed
+
+
+def decompress(data, encoding):
+    return zlib.decompress(data, _get_wbits(encoding))
+
+
+def accepts_encoding(accept_encoding, encoding):
+    """
+    :param accept_encoding: Accept-Encoding header value
+    :param encoding: e.g. GZIP
+    :return: True if the client accepts the encoding
+    """
+    for item in accept_encoding.split(','):
+        parts = item.strip().split(';')
+        name = parts[0].strip().lower()
+        if name not in (encoding, '*'):
+            continue
+        for param in parts[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Queryset export tasks.
+
+Extend AbstractCSVExport or AbstractXLSXExport
+    Define
+        fields = ('<values_list field>', ...)
+    Implement
+        get_queryset(*create_file_args, **create_file_kwargs)
+            (querysets are not serializable so the task gets e.g. filter values)
+
+Rows are read with a server-side cursor (queryset.iterator()) and written
+chunk by chunk, so the worker memory does not grow with the row count.
+"""
+from __future__ import absolute_import, unicode_literals
+import csv
+import io
+import tempfile
+
+import django
+import six
+from django.db.models import Max, Min
+
+from django_celery_async_view.models import FORMAT_CHUNKED
+from django_celery_async_view.task_helpers import AbstractAsyncDownloadCreateFile
+
+DEFAULT_ITERATOR_CHUNK_SIZE = 2000
+
+# csv.writer writes bytes in Python 2
+_CSVBuffer = io.BytesIO if six.PY2 else io.StringIO
+
+# Max rows of a xlsx sheet
+XLSX_MAX_ROWS = 1048576
+
+
+class AbstractQuerySetExport(AbstractAsyncDownloadCreateFile):
+    # values_list() fields
+    fields = ()
+    # header row, defaults to fields, None or () disables
+    headers = None
+    include_headers = True
+    filename = 'export'
+    mimetype = None
+
+    # rows fetched per database round trip (Django >= 2.0)
+    iterator_chunk_size = DEFAULT_ITERATOR_CHUNK_SIZE
+    # If True the rows are counted first (one COUNT query)
+    # and the progress has percent and eta
+    count_rows = False
+
+    # written chunk by chunk, see AbstractAsyncDownloadCreateFile.storage_format
+    storage_format = FORMAT_CHUNKED
+
+    # Partitioned mode: the queryset is split into partition_count pk ranges
+    # that are exported in parallel (requires integer pk and pk ordering,
+    # the stitched file is ordered by pk)
+    partition_count = None
+
+    def get_queryset(self, *args, **kwargs):
+        """
+        :param args: create_file args
+        :param kwargs: create_file kwargs
+        :return: queryset of the exported rows
+        """
+        raise NotImplementedError('This must be implemented when extending.')
+
+    def get_filename(self, *args, **kwargs):
+        return self.filename
+
+    def get_headers(self):
+        if self.headers is None:
+            return list(self.fields)
+        return list(self.headers)
+
+    def format_row(self, row):
+        """
+        :param row: values_list() tuple
+        :return: list of cell values
+        """
+        return row
+
+    def iter_rows(self, queryset):
+        """
+        Yields formatted rows. Progress is reported and cancellation checked
+        once per iterator_chunk_size rows.
+        :param queryset:
+        :return:
+        """
+        total = queryset.count() if self.count_rows else None
+        values = queryset.values_list(*self.fields)
+        if django.VERSION >= (2, 0):
+            rows = values.iterator(chunk_size=self.iterator_chunk_size)
+        else:
+            rows = values.iterator()
+        for index, row in enumerate(rows):
+            if index % self.iterator_chunk_size == 0:
+                self.check_cancelled()
+                self.report_progress(current=index, total=total, stage='rows')
+            yield self.format_row(row)
+
+    def create_file(self, *args, **kwargs):
+        queryset = self.get_queryset(*args, **kwargs)
+        return (
+            self.write_rows(self.iter_rows(queryset), self.include_headers),
+            self.get_filename(*args, **kwargs),
+            self.mimetype)
+
+    def get_partitions(self, *args, **kwargs):
+        """
+        :return: [first pk, last pk] ranges of equal width
+        """
+        if not self.partition_count or self.partition_count < 2:
+            return None
+        queryset = self.get_queryset(*args, **kwargs)
+        self.check_partition_ordering(queryset)
+        pk_range = queryset.aggregate(
+            first_pk=Min('pk'), last_pk=Max('pk'))
+        first_pk, last_pk = pk_range['first_pk'], pk_range['last_pk']
+        if not isinstance(first_pk, six.integer_types):
+            # empty or not integer pk
+            return None
+        width = (last_pk - first_pk) // self.partition_count + 1
+        return [
+            [start, min(start + width - 1, last_pk)]
+            for start in range(first_pk, last_pk + 1, width)]
+
+    def check_partition_ordering(self, queryset):
+        """
+        The pk ranges are stitched in pk order, any other ordering would be lost
+        :param queryset:
+        :raise ValueError: queryset is ordered by other than pk
+        """
+        query = queryset.query
+        ordering = tuple(query.order_by)
+        if not ordering and query.default_ordering:
+            ordering = tuple(queryset.model._meta.ordering)
+        pk_name = queryset.model._meta.pk.name
+        if ordering not in ((), ('pk',), (pk_name,)):
+            raise ValueError(
+                'Partitioned exports are ordered by pk, the queryset is ordered by {}'.format(
+                    ', '.join(six.text_type(field) for field in ordering)))
+
+    def create_partition(self, index, partition, *args, **kwargs):
+        first_pk, last_pk = partition
+        queryset = self.get_queryset(*args, **kwargs).filter(
+            pk__gte=first_pk, pk__lte=last_pk).order_by('pk')
+        return (
+            self.write_rows(self.iter_rows(queryset), self.include_headers and index == 0),
+            self.get_filename(*args, **kwargs),
+            self.mimetype)
+
+    def write_rows(self, rows, include_headers=True):
+        """
+        :param rows: iterable of formatted rows
+        :param include_headers: write the header row
+        :return: _file (see AbstractAsyncDownloadCreateFile.create_file)
+        """
+        raise NotImplementedError('This must be implemented when extending.')
+
+
+class AbstractCSVExport(AbstractQuerySetExport):
+    """
+    create_file() returns a generator of csv text.
+    """
+    filename = 'export.csv'
+    mimetype = 'text/csv'
+    csv_dialect = 'excel'
+    # csv text is yielded in chunks of about this many characters
+    buffer_size = 64 * 1024
+
+    def write_rows(self, rows, include_headers=True):
+        buffer = _CSVBuffer()
+        writer = csv.writer(buffer, dialect=str(self.csv_dialect))
+        if include_headers and self.get_headers():
+            writer.writerow(self._encode_row(self.get_headers()))
+        for row in rows:
+            writer.writerow(self._encode_row(row))
+            if buffer.tell() >= self.buffer_size:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    @staticmethod
+    def _encode_row(row):
+        if not six.PY2:
+            return row
+        return [
+            value.encode('utf-8') if isinstance(value, six.text_type) else value
+            for value in row]
+
+
+class AbstractXLSXExport(AbstractQuerySetExport):
+    """
+    create_file() returns a temporary xlsx file written in constant_memory mode.
+    Requires xlsxwriter package.
+    Note: a sheet has at most XLSX_MAX_ROWS rows.
+    """
+    filename = 'export.xlsx'
+    mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    sheet_name = None
+    workbook_options = {
+        'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+        # xlsx has no timezones
+        'remove_timezone': True,
+    }
+
+    def get_partitions(self, *args, **kwargs):
+        # xlsx files can not be stitched
+        return None
+
+    def write_rows(self, rows, include_headers=True):
+        import xlsxwriter
+        _file = tempfile.TemporaryFile()
+        options = dict(self.workbook_options)
+        # rows are flushed to disk as they are written
+        options.update({'constant_memory': True, 'in_memory': False})
+        workbook = xlsxwriter.Workbook(_file, options)
+        worksheet = workbook.add_worksheet(self.sheet_name)
+        row_index = 0
+        if include_headers and self.get_headers():
+            worksheet.write_row(row_index, 0, self.get_headers())
+            row_index += 1
+        for row in rows:
+            if row_index >= XLSX_MAX_ROWS:
+                raise ValueError('More than {} rows'.format(XLSX_MAX_ROWS))
+            worksheet.write_row(row_index, 0, row)
+            row_index += 1
+        workbook.close()
+        return _file
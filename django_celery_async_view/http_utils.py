@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+import calendar
+import re
+
+from django.utils.http import parse_http_date_safe
+
+_SINGLE_RANGE_RE = re.compile(r'^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$', re.I)
+
+# returned by parse_range_header() if the range is outside of the content
+RANGE_NOT_SATISFIABLE = 'not-satisfiable'
+
+
+def quote_etag(content_hash):
+    return '"{}"'.format(content_hash)
+
+
+def etag_matches(header, etag, weak=True):
+    """
+    :param header: If-None-Match (weak) or If-Range (strong) header value
+    :param etag: quoted etag e.g. '"abc"'
+    :param weak: if True W/"abc" matches "abc"
+    :return: True if header has the etag
+    """
+    for value in header.split(','):
+        value = value.strip()
+        if value == '*':
+            return True
+        if value.startswith('W/'):
+            if not weak:
+                continue
+            value = value[2:]
+        if value == etag:
+            return True
+    return False
+
+
+def timestamp(value):
+    """
+    :param value: aware datetime
+    :return: seconds since epoch
+    """
+    return calendar.timegm(value.utctimetuple())
+
+
+def is_not_modified(request, etag, last_modified):
+    """
+    If-None-Match or If-Modified-Since
+    :param request:
+    :param etag: quoted etag or None
+    :param last_modified: datetime or None
+    :return: True if 304 Not Modified should be returned
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        # If-Modified-Since is ignored if If-None-Match is present
+        return etag is not None and etag_matches(if_none_match, etag)
+    if_modified_since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if if_modified_since is None or last_modified is None:
+        return False
+    return timestamp(last_modified) <= if_modified_since
+
+
+def parse_range_header(request, size, etag, last_modified):
+    """
+    Single byte range of Range header. Multiple ranges are not supported.
+    :param request:
+    :param size: size of the content
+    :param etag: quoted etag or None
+    :param last_modified: datetime or None
+    :return: (start, stop), None if the whole content should be sent
+        or RANGE_NOT_SATISFIABLE
+    """
+    match = _SINGLE_RANGE_RE.match(request.META.get('HTTP_RANGE', ''))
+    if match is None:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is not None and not _if_range_matches(if_range, etag, last_modified):
+        # content has changed, send all of it
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # suffix range: last n bytes
+        suffix_length = int(last)
+        if suffix_length == 0 or size == 0:
+            return RANGE_NOT_SATISFIABLE
+        return max(size - suffix_length, 0), size
+    start = int(first)
+    if start >= size:
+        return RANGE_NOT_SATISFIABLE
+    if not last:
+        return start, size
+    if int(last) < start:
+        # invalid range is ignored
+        return None
+    return start, min(int(last) + 1, size)
+
+
+def _if_range_matches(if_range, etag, last_modified):
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return etag is not None and etag_matches(if_range, etag, weak=False)
+    if_range_date = parse_http_date_safe(if_range)
+    if if_range_date is None or last_modified is None:
+        return False
+    return timestamp(last_modified) == if_range_date
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Task leases and cancellation.
+
+Views with lease_timeout renew the lease of the task on every Phase 2. request
+(also BatchStatusView).
+The task stops (raises TaskCancelled) when it checks is_task_cancelled() and
+    - the lease has expired (the client has stopped polling) or
+    - the task has been cancelled with cancel_task() (cancel endpoint).
+Tasks that are still in the queue are revoked by cancel_task() and
+stop at start if the lease has expired.
+Only the user that started the task (set_task_owner()) can cancel it.
+
+Uses the cache of settings.ASYNC_VIEW_CACHE_ALIAS.
+"""
+from __future__ import absolute_import, unicode_literals
+import time
+
+from django_celery_async_view.cache import get_cache, make_key
+
+# lease and cancel flag are kept at least this long (seconds)
+# so that the task can still see an expired lease
+MIN_LEASE_KEY_TIMEOUT = 60 * 60
+
+
+class TaskCancelled(Exception):
+    """
+    Raised in the task when the client has abandoned or cancelled it.
+    """
+
+
+def _lease_key(task_id):
+    return make_key('lease', task_id)
+
+
+def _cancel_key(task_id):
+    return make_key('cancel', task_id)
+
+
+def _owner_key(task_id):
+    return make_key('owner', task_id)
+
+
+def renew_lease(task_id, lease_timeout, wait=0):
+    """
+    :param task_id:
+    :param lease_timeout: seconds until the lease expires
+    :param wait: extra seconds for requests that wait (long polling, events)
+    :return:
+    """
+    get_cache().set(
+        _lease_key(task_id), (time.time() + lease_timeout + wait, lease_timeout),
+        _get_key_timeout(lease_timeout + wait))
+
+
+def renew_existing_leases(task_ids):
+    """
+    Renews the leases of the tasks that have one with their own lease_timeout.
+    Used by the batch status view that does not know the views of the tasks.
+    :param task_ids:
+    :return:
+    """
+    cache = get_cache()
+    keys = dict((_lease_key(task_id), task_id) for task_id in task_ids)
+    now = time.time()
+    renewed = dict(
+        (key, (now + lease_timeout, lease_timeout))
+        for key, (_, lease_timeout) in cache.get_many(list(keys)).items())
+    if renewed:
+        cache.set_many(renewed, _get_key_timeout(
+            max(lease_timeout for _, lease_timeout in renewed.values())))
+
+
+def set_task_owner(task_id, user_id, lease_timeout):
+    """
+    :param task_id:
+    :param user_id: user that started the task, None if the task has no owner
+    :param lease_timeout:
+    :return:
+    """
+    get_cache().set(_owner_key(task_id), {'user_id': user_id}, _get_key_timeout(lease_timeout))
+
+
+def get_task_owner(task_id):
+    """
+    :param task_id:
+    :return: {'user_id': user_id} or None if the task was not started with a lease
+    """
+    return get_cache().get(_owner_key(task_id))
+
+
+def _get_key_timeout(lease_timeout):
+    return max(lease_timeout * 10, MIN_LEASE_KEY_TIMEOUT)
+
+
+def cancel_task(result, terminate=False):
+    """
+    Revokes the task (queued tasks are not started) and
+    sets the cancel flag (running tasks stop at the next check).
+    :param result: AsyncResult
+    :param terminate: if True running task is terminated (see celery revoke)
+    :return:
+    """
+    get_cache().set(_cancel_key(result.id), True, MIN_LEASE_KEY_TIMEOUT)
+    result.revoke(terminate=terminate)
+
+
+def is_task_cancelled(task_id):
+    """
+    :param task_id:
+    :return: True if the task is cancelled or its lease has expired.
+        Tasks without lease are not cancelled.
+    """
+    lease_key = _lease_key(task_id)
+    cancel_key = _cancel_key(task_id)
+    values = get_cache().get_many([lease_key, cancel_key])
+    if values.get(cancel_key):
+        return True
+    lease = values.get(lease_key)
+    return lease is not None and lease[0] < time.time()
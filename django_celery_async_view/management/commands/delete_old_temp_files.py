@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from django_celery_async_view.models import TempFile
+from django_celery_async_view.tasks import DEFAULT_DELETE_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired TempFiles in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_DELETE_BATCH_SIZE,
+            help='How many TempFiles are deleted at once.')
+
+    def handle(self, *args, **options):
+        deleted_count = TempFile.objects.delete_old_files(
+            batch_size=options['batch_size'])
+        self.stdout.write('Deleted {} TempFiles.'.format(deleted_count))
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_celery_async_view', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tempfile',
+            name='binary',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tempfile',
+            name='storage_format',
+            field=models.CharField(choices=[('base64', 'base64'), ('binary', 'binary')], default='base64', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='tempfile',
+            name='bytes',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
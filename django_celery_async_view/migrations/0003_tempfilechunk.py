@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:22
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_celery_async_view', '0002_tempfile_binary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TempFileChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='tempfile',
+            name='storage_format',
+            field=models.CharField(choices=[('base64', 'base64'), ('binary', 'binary'), ('chunked', 'chunked')], default='base64', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='tempfilechunk',
+            name='temp_file',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='django_celery_async_view.TempFile'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='tempfilechunk',
+            unique_together=set([('temp_file', 'index')]),
+        ),
+    ]
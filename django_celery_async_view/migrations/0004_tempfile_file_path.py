@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:24
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_celery_async_view', '0003_tempfilechunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tempfile',
+            name='file_path',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='tempfile',
+            name='storage_format',
+            field=models.CharField(choices=[('base64', 'base64'), ('binary', 'binary'), ('chunked', 'chunked'), ('filesystem', 'filesystem')], default='base64', max_length=20),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import ExpressionWrapper, F
+
+
+def set_expires_at(apps, schema_editor):
+    TempFile = apps.get_model('django_celery_async_view', 'TempFile')
+    TempFile.objects.filter(expires_at__isnull=True).update(
+        expires_at=ExpressionWrapper(
+            F('created_datetime') + F('duration'),
+            output_field=models.DateTimeField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_celery_async_view', '0004_tempfile_file_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tempfile',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.RunPython(set_expires_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tempfile',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:35
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_celery_async_view', '0005_tempfile_expires_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tempfile',
+            name='content_encoding',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:39
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_celery_async_view', '0006_tempfile_content_encoding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tempfile',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='tempfile',
+            name='size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
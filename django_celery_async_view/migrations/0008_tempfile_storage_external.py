@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Streaming reads the base64 / binary content in SUBSTR slices.
+# Postgres decompresses a compressed (TOAST EXTENDED) value from the start
+# for every slice, EXTERNAL values are stored uncompressed and sliced directly.
+CONTENT_COLUMNS = ('bytes', 'binary')
+
+
+def _set_storage(apps, schema_editor, storage):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    TempFile = apps.get_model('django_celery_async_view', 'TempFile')
+    table = schema_editor.quote_name(TempFile._meta.db_table)
+    for column in CONTENT_COLUMNS:
+        schema_editor.execute('ALTER TABLE {} ALTER COLUMN {} SET STORAGE {}'.format(
+            table, schema_editor.quote_name(column), storage))
+
+
+def set_storage_external(apps, schema_editor):
+    _set_storage(apps, schema_editor, 'EXTERNAL')
+
+
+def set_storage_extended(apps, schema_editor):
+    _set_storage(apps, schema_editor, 'EXTENDED')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_celery_async_view', '0007_tempfile_content_hash_size'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_storage_external, set_storage_extended),
+    ]
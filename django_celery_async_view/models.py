@@ -1,32 +1,189 @@
 # -*- coding: utf-8
 from __future__ import absolute_import, unicode_literals
+import errno
+import os
 from datetime import timedelta
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.db import models
-from django.db.models import F
+from django.db.models.functions import Length, Substr
 from django.utils import timezone
 
 DEFAULT_TEMP_FILE_DURATION_MS = 10 * 60 * 1000  # 10min
 
+# TempFile.storage_format
+# content is base64 encoded in TempFile.bytes
+FORMAT_BASE64 = 'base64'
+# content is raw bytes in TempFile.binary
+FORMAT_BINARY = 'binary'
+# content is raw bytes in TempFileChunk rows
+FORMAT_CHUNKED = 'chunked'
+# content is in file TempFile.file_path in ASYNC_VIEW_TEMP_FILE_ROOT
+FORMAT_FILESYSTEM = 'filesystem'
+STORAGE_FORMAT_CHOICES = (
+    (FORMAT_BASE64, 'base64'),
+    (FORMAT_BINARY, 'binary'),
+    (FORMAT_CHUNKED, 'chunked'),
+    (FORMAT_FILESYSTEM, 'filesystem'),
+)
+
+
+def get_temp_file_root():
+    """
+    :return: directory of FORMAT_FILESYSTEM files
+    """
+    root = getattr(settings, 'ASYNC_VIEW_TEMP_FILE_ROOT', None)
+    if not root:
+        raise ImproperlyConfigured(
+            'ASYNC_VIEW_TEMP_FILE_ROOT is required with TempFileFileSystemStorage')
+    return root
+
 
 class TempFileManager(models.Manager):
 
-    def delete_old_files(self):
+    def expired(self):
+        """
+        Uses indexed expires_at (created_datetime + duration).
+        :return: TempFiles that are older than TempFile.duration
+        """
+        return self.filter(expires_at__lte=timezone.now())
+
+    def delete_old_files(self, batch_size=None):
         """
         Deletes this files that are older than TempFile.duration.
+        :param batch_size: if set files are deleted in batches of batch_size
+            so that single delete does not lock too many rows
+        :return: number of deleted TempFiles if batch_size is set
+        """
+        old_files = self.expired()
+        if batch_size is None:
+            self._delete_files(old_files)
+            return None
+        deleted_count = 0
+        while True:
+            pks = list(old_files.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return deleted_count
+            self._delete_files(self.filter(pk__in=pks))
+            deleted_count += len(pks)
+
+    def delete_files(self, pks):
+        """
+        Deletes TempFiles and their file system files.
+        :param pks:
         :return:
         """
-        self.filter(
-            created_datetime__lte=
-            timezone.now() - F('duration')
-        ).delete()
+        self._delete_files(self.filter(pk__in=pks))
+
+    def _delete_files(self, queryset):
+        self._delete_file_system_files(queryset)
+        # only('pk') so that the content is not loaded when collecting related chunks
+        queryset.only('pk').delete()
+
+    def _delete_file_system_files(self, queryset):
+        file_paths = queryset.filter(
+            storage_format=FORMAT_FILESYSTEM
+        ).values_list('file_path', flat=True)
+        for file_path in file_paths:
+            try:
+                os.remove(os.path.join(get_temp_file_root(), file_path))
+            except OSError as e:
+                # already deleted
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def iter_encoded_chunks(self, pk, encoded_chunk_size, start=0):
+        """
+        Yields the base64 content of TempFile pk in slices of
+        encoded_chunk_size characters. Each slice is fetched with
+        its own query so the whole content is never in memory.
+        :param pk:
+        :param encoded_chunk_size:
+        :param start: position of the first character
+        :return:
+        """
+        return self._iter_field_chunks(pk, 'bytes', encoded_chunk_size, start=start)
+
+    def iter_binary_chunks(self, pk, chunk_size, start=0):
+        """
+        Yields the raw content of TempFile pk (FORMAT_BINARY)
+        in slices of chunk_size bytes.
+        :param pk:
+        :param chunk_size:
+        :param start: position of the first byte
+        :return:
+        """
+        for chunk in self._iter_field_chunks(
+                pk, 'binary', chunk_size, output_field=models.BinaryField(),
+                start=start):
+            yield bytes(chunk)
+
+    def iter_chunks(self, pk, start=0):
+        """
+        Yields the content of TempFile pk (FORMAT_CHUNKED)
+        one TempFileChunk at a time.
+        :param pk:
+        :param start: position of the first byte
+        :return:
+        """
+        index = 0
+        offset = 0
+        if start:
+            # find the chunk of the start position without loading the data
+            chunk_lengths = TempFileChunk.objects.filter(
+                temp_file_id=pk
+            ).order_by('index').annotate(
+                length=Length('data')
+            ).values_list('index', 'length')
+            position = 0
+            for index, length in chunk_lengths:
+                if position + length > start:
+                    break
+                position += length
+            else:
+                return
+            offset = start - position
+        while True:
+            chunks = TempFileChunk.objects.filter(
+                temp_file_id=pk, index=index
+            ).values_list('data', flat=True)[:1]
+            if not chunks:
+                return
+            yield bytes(chunks[0][offset:])
+            offset = 0
+            index += 1
+
+    def _iter_field_chunks(self, pk, field_name, chunk_size, output_field=None, start=0):
+        position = start + 1  # SQL SUBSTR is 1-indexed
+        while True:
+            chunk = self.filter(pk=pk).annotate(
+                chunk=Substr(field_name, position, chunk_size,
+                             output_field=output_field)
+            ).values_list('chunk', flat=True).first()
+            if not chunk:
+                return
+            yield chunk
+            position += chunk_size
 
 
 class TempFile(models.Model):
-    bytes = models.TextField()
+    # FORMAT_BASE64 content
+    bytes = models.TextField(default='', blank=True)
+    # FORMAT_BINARY content
+    binary = models.BinaryField(null=True, blank=True)
+    storage_format = models.CharField(
+        max_length=20, choices=STORAGE_FORMAT_CHOICES, default=FORMAT_BASE64)
+    # FORMAT_FILESYSTEM content, relative to ASYNC_VIEW_TEMP_FILE_ROOT
+    file_path = models.CharField(max_length=255, default='', blank=True)
     filename = models.CharField(max_length=1000)
     mimetype = models.CharField(max_length=255)
+    # content is compressed: 'gzip' or 'deflate' (HTTP Content-Encoding)
+    content_encoding = models.CharField(max_length=20, default='', blank=True)
+    # sha256 and size of the stored (compressed) content, set on save
+    # used in ETag and Range responses
+    content_hash = models.CharField(max_length=64, default='', blank=True)
+    size = models.BigIntegerField(null=True, blank=True)
 
     # auto_now_add set only when model is created
     created_datetime = models.DateTimeField(auto_now_add=True)
@@ -36,6 +193,9 @@ class TempFile(models.Model):
                 settings, 'ASYNC_VIEW_TEMP_FILE_DURATION_MS',
                 DEFAULT_TEMP_FILE_DURATION_MS)))
 
+    # created_datetime + duration, set on save
+    expires_at = models.DateTimeField(db_index=True)
+
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.DO_NOTHING,
@@ -45,3 +205,30 @@ class TempFile(models.Model):
     description = models.TextField(default='', blank=True, null=False)
 
     objects = TempFileManager()
+
+    def save(self, *args, **kwargs):
+        if self.expires_at is None:
+            self.expires_at = (self.created_datetime or timezone.now()) + self.duration
+        super(TempFile, self).save(*args, **kwargs)
+
+    def get_file_path(self):
+        """
+        :return: absolute path of FORMAT_FILESYSTEM content
+        """
+        return os.path.join(get_temp_file_root(), self.file_path)
+
+
+class TempFileChunk(models.Model):
+    """
+    Part of the TempFile content (FORMAT_CHUNKED).
+    """
+    temp_file = models.ForeignKey(
+        TempFile,
+        on_delete=models.CASCADE,
+        related_name='chunks'
+    )
+    index = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        unique_together = ('temp_file', 'index')
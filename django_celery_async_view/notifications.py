@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Task completion notifications (pub/sub) used by the Server-Sent Events
+endpoint (Phase 2. with events=true).
+
+Celery task_success and task_failure signals publish the completion of a task
+into the backend defined in settings.ASYNC_VIEW_NOTIFICATION_BACKEND.
+The views wait for it instead of polling the result backend.
+
+    ASYNC_VIEW_NOTIFICATION_BACKEND = \
+        'django_celery_async_view.notifications.RedisNotificationBackend'
+    ASYNC_VIEW_NOTIFICATION_REDIS_URL = 'redis://localhost:6379/0'
+"""
+from __future__ import absolute_import, unicode_literals
+
+import threading
+import time
+
+from celery.signals import task_success, task_failure
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+EVENT_SUCCESS = 'success'
+EVENT_FAILURE = 'failure'
+
+# How long published events are kept (seconds).
+# Subscriber that starts waiting after the task has finished still gets the event.
+DEFAULT_EVENT_TTL = 10 * 60
+
+
+class BaseNotificationBackend(object):
+    # ASGI views: dotted path of the class that waits for the events
+    # in the event loop (see asgi_views.get_notification_waiter),
+    # None: wait() is called in a thread pool
+    async_waiter_class = None
+
+    def __init__(self, event_ttl=None):
+        if event_ttl is None:
+            event_ttl = getattr(
+                settings, 'ASYNC_VIEW_NOTIFICATION_EVENT_TTL', DEFAULT_EVENT_TTL)
+        self.event_ttl = event_ttl
+
+    def publish(self, task_id, event):
+        """
+        :param task_id:
+        :param event: EVENT_SUCCESS or EVENT_FAILURE
+        :return:
+        """
+        raise NotImplementedError('This must be implemented when extending.')
+
+    def wait(self, task_id, timeout):
+        """
+        Blocks until event of task_id is published or timeout.
+        :param task_id:
+        :param timeout: seconds
+        :return: event or None if timeout
+        """
+        raise NotImplementedError('This must be implemented when extending.')
+
+
+class LocalNotificationBackend(BaseNotificationBackend):
+    """
+    In-process backend.
+    Works only when celery worker runs in the same process e.g. in tests.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(LocalNotificationBackend, self).__init__(*args, **kwargs)
+        self._condition = threading.Condition()
+        # task_id: (event, expires)
+        self._events = {}
+
+    def publish(self, task_id, event):
+        with self._condition:
+            now = time.time()
+            self._events = dict(
+                (key, value) for key, value in self._events.items()
+                if value[1] > now)
+            self._events[task_id] = (event, now + self.event_ttl)
+            self._condition.notify_all()
+
+    def wait(self, task_id, timeout):
+        deadline = time.time() + timeout
+        with self._condition:
+            while task_id not in self._events:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+            return self._events[task_id][0]
+
+
+class RedisNotificationBackend(BaseNotificationBackend):
+    """
+    Publishes events into redis channels.
+    Requires redis package.
+    """
+    key_prefix = 'django_celery_async_view:task_event:'
+    async_waiter_class = 'django_celery_async_view.asgi_views.AsyncRedisNotificationWaiter'
+
+    def __init__(self, url=None, *args, **kwargs):
+        super(RedisNotificationBackend, self).__init__(*args, **kwargs)
+        import redis
+        if url is None:
+            url = settings.ASYNC_VIEW_NOTIFICATION_REDIS_URL
+        self.url = url
+        self.client = redis.StrictRedis.from_url(url)
+
+    def publish(self, task_id, event):
+        key = self.key_prefix + task_id
+        pipeline = self.client.pipeline()
+        # kept for the subscribers that start waiting later
+        pipeline.setex(key, self.event_ttl, event)
+        pipeline.publish(key, event)
+        pipeline.execute()
+
+    def wait(self, task_id, timeout):
+        key = self.key_prefix + task_id
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(key)
+            # published before subscribe
+            event = self.client.get(key)
+            deadline = time.time() + timeout
+            while event is None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                message = pubsub.get_message(timeout=remaining)
+                if message is not None:
+                    event = message['data']
+        finally:
+            pubsub.close()
+        return event.decode('utf-8') if isinstance(event, bytes) else event
+
+
+_backend_lock = threading.Lock()
+_backends = {}
+
+
+def get_notification_backend():
+    """
+    :return: backend defined in settings.ASYNC_VIEW_NOTIFICATION_BACKEND
+        or None if notifications are not used
+    """
+    backend_path = getattr(settings, 'ASYNC_VIEW_NOTIFICATION_BACKEND', None)
+    if backend_path is None:
+        return None
+    with _backend_lock:
+        if backend_path not in _backends:
+            _backends[backend_path] = import_string(backend_path)()
+        return _backends[backend_path]
+
+
+@task_success.connect
+def _publish_task_success(sender=None, **kwargs):
+    backend = get_notification_backend()
+    if backend is not None:
+        backend.publish(sender.request.id, EVENT_SUCCESS)
+
+
+@task_failure.connect
+def _publish_task_failure(sender=None, task_id=None, **kwargs):
+    backend = get_notification_backend()
+    if backend is not None:
+        backend.publish(task_id, EVENT_FAILURE)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Codecs of the content in run_use_result_backend() results (use_db=False).
+Codec is chosen per task (AbstractAsyncDownloadCreateFile.payload_codec)
+and its name is stored in the result so open_result() can decode it.
+
+Custom codecs are registered with
+    ASYNC_VIEW_PAYLOAD_CODECS = {'<name>': '<dotted path of BasePayloadCodec subclass>'}
+"""
+from __future__ import absolute_import, unicode_literals
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from six.moves import range
+
+from django_celery_async_view.models import TempFile
+from django_celery_async_view.task_helpers import STREAM_CHUNK_SIZE, \
+    TEMP_FILE_METADATA_FIELDS, b64decode, get_storage, get_temp_file_content, \
+    iter_decoded_chunks, iter_temp_file_chunks
+
+# base64 text, works with every result serializer (default)
+CODEC_BASE64 = 'base64'
+# raw bytes, requires result serializer that supports bytes (pickle, msgpack)
+CODEC_RAW = 'raw'
+# content is stored in TempFile, result has only TempFile id
+CODEC_TEMP_FILE = 'temp_file'
+
+DEFAULT_PAYLOAD_CODECS = {
+    CODEC_BASE64: 'django_celery_async_view.payload_codecs.Base64PayloadCodec',
+    CODEC_RAW: 'django_celery_async_view.payload_codecs.RawPayloadCodec',
+    CODEC_TEMP_FILE: 'django_celery_async_view.payload_codecs.TempFilePayloadCodec',
+}
+
+_codecs = {}
+_codec_lock = threading.Lock()
+
+
+class BasePayloadCodec(object):
+
+    def encode(self, content, save_kwargs):
+        """
+        :param content: string, file object or iterable of strings
+        :param save_kwargs: user_id, mimetype, description, duration, content_encoding,
+            storage_format for codecs that store the content out-of-band
+        :return: result['content']
+        """
+        raise NotImplementedError()
+
+    def decode(self, value):
+        """
+        :param value: result['content']
+        :return: decoded content
+        """
+        raise NotImplementedError()
+
+    def iter_decoded(self, value, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        :param value: result['content']
+        :param chunk_size:
+        :return: generator of decoded chunks
+        """
+        content = self.decode(value)
+        for start in range(0, len(content), chunk_size):
+            yield content[start:start + chunk_size]
+
+
+class Base64PayloadCodec(BasePayloadCodec):
+
+    def encode(self, content, save_kwargs):
+        return get_storage()._get_encoded_bytes_from_file(content)
+
+    def decode(self, value):
+        return b64decode(value)
+
+    def iter_decoded(self, value, chunk_size=STREAM_CHUNK_SIZE):
+        return iter_decoded_chunks(value, chunk_size)
+
+
+class RawPayloadCodec(BasePayloadCodec):
+
+    def encode(self, content, save_kwargs):
+        return get_storage()._get_bytes_from_file(content)
+
+    def decode(self, value):
+        return bytes(value)
+
+
+class TempFilePayloadCodec(BasePayloadCodec):
+    """
+    Content is stored with ASYNC_VIEW_STORAGE_BACKEND.
+    """
+
+    def encode(self, content, save_kwargs):
+        save_kwargs = dict(save_kwargs)
+        storage = get_storage(save_kwargs.pop('storage_format', None))
+        return storage._save(
+            name=save_kwargs.pop('filename'), content=content, **save_kwargs).id
+
+    def decode(self, value):
+        return get_temp_file_content(self._get_temp_file(value))
+
+    def iter_decoded(self, value, chunk_size=STREAM_CHUNK_SIZE):
+        return iter_temp_file_chunks(self._get_temp_file(value), chunk_size)
+
+    def _get_temp_file(self, temp_file_id):
+        return TempFile.objects.only(*TEMP_FILE_METADATA_FIELDS).get(id=temp_file_id)
+
+
+def get_payload_codec(name):
+    """
+    :param name: e.g. CODEC_BASE64
+    :return: codec from DEFAULT_PAYLOAD_CODECS or settings.ASYNC_VIEW_PAYLOAD_CODECS
+    """
+    codec_paths = dict(DEFAULT_PAYLOAD_CODECS)
+    codec_paths.update(getattr(settings, 'ASYNC_VIEW_PAYLOAD_CODECS', {}))
+    try:
+        codec_path = codec_paths[name]
+    except KeyError:
+        raise ValueError('Unknown payload codec {!r}'.format(name))
+    with _codec_lock:
+        if codec_path not in _codecs:
+            _codecs[codec_path] = import_string(codec_path)()
+        return _codecs[codec_path]
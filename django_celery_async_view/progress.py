@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Progress of running tasks.
+
+AbstractAsyncDownloadCreateFile.report_progress() writes the progress to the cache
+(settings.ASYNC_VIEW_CACHE_ALIAS, shared by web processes and workers)
+and Phase 2. responses include it:
+    {"ready": false, "progress": {"percent": 40.0, "current": 400, "total": 1000,
+                                  "stage": "rows"},
+     "eta": <estimated seconds remaining>}
+"""
+from __future__ import absolute_import, unicode_literals
+import time
+
+from django_celery_async_view.cache import get_cache, make_key
+
+# progress is kept this long after the last report (seconds)
+PROGRESS_TIMEOUT = 60 * 60
+
+
+def _progress_key(task_id):
+    return make_key('progress', task_id)
+
+
+def set_progress(task_id, progress, eta=None):
+    """
+    :param task_id:
+    :param progress: dict of percent, current, total, stage
+    :param eta: estimated seconds remaining or None
+    :return:
+    """
+    get_cache().set(
+        _progress_key(task_id),
+        {'progress': progress, 'eta': eta, 'updated': time.time()},
+        PROGRESS_TIMEOUT)
+
+
+def get_progress(task_id):
+    """
+    :param task_id:
+    :return: {'progress': dict, 'eta': seconds or None} or None if not reported
+    """
+    return get_many_progress([task_id]).get(task_id)
+
+
+def get_many_progress(task_ids):
+    """
+    Progress of many tasks with one cache query.
+    :param task_ids:
+    :return: {task_id: {'progress': dict, 'eta': seconds or None}}
+        tasks without progress are left out
+    """
+    keys = dict((_progress_key(task_id), task_id) for task_id in task_ids)
+    now = time.time()
+    many_progress = {}
+    for key, value in get_cache().get_many(list(keys)).items():
+        eta = value['eta']
+        if eta is not None:
+            # time passed since the report
+            eta = max(eta - (now - value['updated']), 0)
+        many_progress[keys[key]] = {'progress': value['progress'], 'eta': eta}
+    return many_progress
+
+
+def start_partitions(task_id):
+    """
+    Partitioned mode: progress is the share of finished partitions.
+    :param task_id: task that started the partitions
+    :return:
+    """
+    cache = get_cache()
+    cache.set(make_key('partitions-started', task_id), time.time(), PROGRESS_TIMEOUT)
+    cache.set(make_key('partitions-done', task_id), 0, PROGRESS_TIMEOUT)
+
+
+def partition_done(task_id, partition_count):
+    """
+    :param task_id: task that started the partitions
+    :param partition_count:
+    :return:
+    """
+    cache = get_cache()
+    started_at = cache.get(make_key('partitions-started', task_id))
+    try:
+        done = cache.incr(make_key('partitions-done', task_id))
+    except ValueError:
+        # expired
+        return
+    now = time.time()
+    percent = 100.0 * done / partition_count
+    set_progress(task_id, {
+        'percent': percent,
+        'current': done,
+        'total': partition_count,
+        'stage': 'partitions',
+    }, eta=None if started_at is None else estimate_remaining(started_at, 0, percent, now))
+
+
+def estimate_remaining(started_at, started_percent, percent, now):
+    """
+    Linear estimate from the progress made since started_at.
+    :param started_at: time of the first report
+    :param started_percent: percent of the first report
+    :param percent: current percent
+    :param now:
+    :return: seconds remaining or None if it can not be estimated
+    """
+    if percent is None or started_percent is None or percent <= started_percent \
+            or now <= started_at:
+        return None
+    rate = (percent - started_percent) / (now - started_at)
+    return (100.0 - percent) / rate
@@ -25,9 +25,33 @@
  *      returns {"task_id": "<task_id>"}
  * # Phase 2. ajax GET base_url?task_id=<task_id>
  *     returns {"ready": "<is the task ready>"}
+ *     and if the task reports progress
+ *     {"progress": {"percent", "current", "total", "stage"}, "eta": <seconds>}
+ *     next poll is timed by the eta (eta_poll_factor)
  * # Phase 3.
  *     window.href=base_url?task_id=<task_id>&download=true
  *
+ * Server-Sent Events (options.events = true)
+ * # Phase 2. EventSource base_url?task_id=<task_id>&events=true
+ *     server sends "ready" event when the task has finished
+ *     falls back to polling if EventSource is not available
+ *
+ * Long polling (options.long_poll = true)
+ * # Phase 2. ajax GET base_url?task_id=<task_id>&long_poll=true
+ *     server responds when the task is ready or after its long_poll_timeout
+ *
+ * Batch status (AsyncViews.batch_status_url = <BatchStatusView url>)
+ * # Phase 2. ajax GET batch_status_url?task_ids=<task_id>,<task_id>
+ *     every pending task on the page is polled with one request
+ *     returns {"tasks": {"<task_id>": {"ready": "<is the task ready>"}}}
+ *
+ * Cancel (AsyncViews.cancelTask(base_url, task_id))
+ * # Phase 2. ajax POST base_url?task_id=<task_id>&cancel=true
+ *     X-CSRFToken header from the csrf_cookie_name cookie
+ *     called when max_polls is reached and for pending tasks
+ *     when the page is left (AsyncViews.cancel_on_unload)
+ *     only for the tasks of views with lease_timeout started by a logged in user
+ *     (Phase 1. "cancellable", options.cancellable)
  *
  * @type {{createAsyncDownloadListener, createUrl, startFileCreation, pollIfFileIsNotReady, pollIsFileReady, downloadFile, initAsyncView}}
  */
@@ -37,6 +61,34 @@ var AsyncViews = (function(){
 
         max_polls: 20,
 
+        // Poll interval when the task reports eta:
+        // eta * eta_poll_factor limited to [min_poll_interval, max_poll_interval]
+        eta_poll_factor: 0.5,
+        min_poll_interval: 500,
+        max_poll_interval: 10000,
+
+        // Used with options.long_poll
+        // ajax timeout, should be longer than the view's long_poll_timeout
+        long_poll_timeout: 30000,
+        // delay between long poll requests
+        long_poll_interval: 100,
+
+        // Phase 2. of every pending task is done with one request
+        // if the url of BatchStatusView is set
+        // options.batch = false opts out
+        batch_status_url: null,
+        batch_poll_interval: 2000,
+        // pending tasks by task_id
+        _batch_tasks: {},
+        _batch_timeout: null,
+
+        // pending cancellable tasks are cancelled when the page is left
+        cancel_on_unload: true,
+        // base_url of pending cancellable tasks by task_id
+        _pending_tasks: {},
+        // settings.CSRF_COOKIE_NAME, cancel is POST
+        csrf_cookie_name: 'csrftoken',
+
         // =========
         // AsyncView
         // =========
@@ -52,13 +104,24 @@ var AsyncViews = (function(){
          * @param options.max_polls
          * @param options.task_id
          * @param options.base_url
+         * @param options.long_poll
+         *      boolean, server waits until the task is ready
+         * @param options.long_poll_timeout
+         *      in milliseconds, ajax timeout of the long poll request
+         * @param options.events
+         *      boolean, wait for the Server-Sent "ready" event instead of polling
+         * @param options.batch
+         *      false: do not poll through batch_status_url
+         * @param options.cancellable
+         *      boolean, the task can be cancelled (loading page context "cancellable")
+         * @param options.progress <function(progress, eta) called when the task reports progress>
          * @param options.success
          * @param options.error
          * @param options.complete
          */
         initAsyncView: function(options){
             var that = this;
-            var poll_interval = options.poll_interval || [500, 2500, 10000];
+            var poll_interval = that._getPollInterval(options);
             var task_id = options.task_id;
             if(task_id === undefined)throw new Error('task_id not defined');
             var base_url = options.base_url;
@@ -67,24 +130,31 @@ var AsyncViews = (function(){
             }
             var max_polls = options.max_polls || that.max_polls;
             var poll_count = 0;
+            function onPollLimit(){
+                that._cancelPendingTask(task_id);
+                that._createAjaxErrorFunction(options)();
+            }
             function poll() {
                 poll_count += 1;
                 $.ajax({
-                    url: that._createUrl(base_url, task_id),
+                    url: that._createPollUrl(base_url, task_id, options),
                     type: "GET",
                     success: function(data) {
                         if (!data.ready){
+                            that._reportProgress(options, data);
                             if(poll_count >= max_polls){
                                 // Poll limit reached
-                                that._createAjaxErrorFunction(options)();
+                                onPollLimit();
                             }else{
                                 // NEXT POLL
                                 that._setTimeout(
                                     function() {poll();},
-                                    poll_interval, poll_count
+                                    that._adaptPollInterval(poll_interval, data, options),
+                                    poll_count
                                 );
                             }
                         } else {
+                            that._untrackTask(task_id);
                             that._createAjaxSuccessFunction(options)();
                             document.open();
                             document.write(data['html']);
@@ -94,14 +164,32 @@ var AsyncViews = (function(){
                     },
                     error: that._createAjaxErrorFunction(options),
                     dataType: 'json',
-                    timeout: 2000
+                    timeout: that._getPollTimeout(options)
                 });
             }
+            function startPolling(){
+                that._setTimeout(
+                    function() {poll();},
+                    poll_interval, poll_count
+                );
+            }
+            if(options.cancellable){
+                that._trackTask(base_url, task_id);
+            }
+            if(options.events){
+                // Get html when the task is ready
+                that._waitForTaskEvent(base_url, task_id, poll, startPolling);
+                return;
+            }
+            if(that._useBatch(options)){
+                // Get html when the task is ready
+                that._waitInBatch(
+                    task_id, max_polls, poll, onPollLimit,
+                    function(status){that._reportProgress(options, status);});
+                return;
+            }
             // Start polling
-            that._setTimeout(
-                function() {poll();},
-                poll_interval, poll_count
-            );
+            startPolling();
         },
 
         // =============
@@ -123,6 +211,15 @@ var AsyncViews = (function(){
          *      array of integers e.g. [500, 2500, 10000]
          *      The poll interval will be taken from the array in order
          *      last is used when none left
+         * @param options.long_poll
+         *      boolean, server waits until the file is ready
+         * @param options.long_poll_timeout
+         *      in milliseconds, ajax timeout of the long poll request
+         * @param options.events
+         *      boolean, wait for the Server-Sent "ready" event instead of polling
+         * @param options.batch
+         *      false: do not poll through batch_status_url
+         * @param options.progress <function(progress, eta) called when the task reports progress>
          * @param options.success: <function called when file download starts>
          *        even though success is called the download itself might still fail
          * @param options.error: <function called if ajax fails before download called>
@@ -133,7 +230,7 @@ var AsyncViews = (function(){
             var that = this;
             var base_url = options.base_url;
             if(base_url === undefined)throw new Error('base_url not defined');
-            var poll_interval = options.poll_interval || [500, 2500, 10000];
+            var poll_interval = that._getPollInterval(options);
             var max_polls = options.max_polls || that.max_polls;
             $.ajax({
                 url: base_url,
@@ -141,9 +238,37 @@ var AsyncViews = (function(){
                 success: function(data) {
                     var task_id = data.task_id;
                     var ready = data.ready;
-                    that._pollIfFileIsNotReady(
-                        base_url, task_id, ready, poll_interval, max_polls,
-                        0, options);
+                    if(!ready && data.cancellable){
+                        that._trackTask(base_url, task_id);
+                    }
+                    function startPolling(){
+                        if(!ready && that._useBatch(options)){
+                            that._waitInBatch(
+                                task_id, max_polls,
+                                function(){
+                                    that._downloadFile(base_url, task_id, options);
+                                },
+                                function(){
+                                    that._cancelPendingTask(task_id);
+                                    that._createAjaxErrorFunction(options)();
+                                },
+                                function(status){that._reportProgress(options, status);});
+                            return;
+                        }
+                        that._pollIfFileIsNotReady(
+                            base_url, task_id, ready, poll_interval, max_polls,
+                            0, options);
+                    }
+                    if(!ready && options.events){
+                        that._waitForTaskEvent(
+                            base_url, task_id,
+                            function(){
+                                that._downloadFile(base_url, task_id, options);
+                            },
+                            startPolling);
+                        return;
+                    }
+                    startPolling();
                 },
                 error: that._createAjaxErrorFunction(options),
                 dataType: 'json',
@@ -156,7 +281,7 @@ var AsyncViews = (function(){
          */
         _pollIfFileIsNotReady: function(
                 base_url, task_id, ready, poll_interval, max_polls,
-                poll_count, options){
+                poll_count, options, data){
             var that = this;
             if (!ready){
                 // # Phase 2.B
@@ -167,7 +292,7 @@ var AsyncViews = (function(){
                             poll_count, options
                         );
                     },
-                    poll_interval,
+                    that._adaptPollInterval(poll_interval, data, options),
                     poll_count
                 );
             } else {
@@ -191,23 +316,27 @@ var AsyncViews = (function(){
             var that = this;
             poll_count += 1;
             $.ajax({
-                url: that._createUrl(base_url, task_id),
+                url: that._createPollUrl(base_url, task_id, options),
                 type: 'GET',
                 success: function(data) {
                     ready = data.ready;
+                    if(!ready){
+                        that._reportProgress(options, data);
+                    }
                     if(!ready && poll_count >= max_polls){
                         // Poll limit reached
+                        that._cancelPendingTask(task_id);
                         that._createAjaxErrorFunction(options)();
                         return;
                     }
                     // # Phase 2.A
                     that._pollIfFileIsNotReady(
                         base_url, task_id, ready, poll_interval, max_polls,
-                        poll_count, options);
+                        poll_count, options, data);
                 },
                 error: that._createAjaxErrorFunction(options),
                 dataType: 'json',
-                timeout: 2000
+                timeout: that._getPollTimeout(options)
             });
         },
 
@@ -216,10 +345,218 @@ var AsyncViews = (function(){
          */
         _downloadFile: function(base_url, task_id, options){
             var that = this;
+            that._untrackTask(task_id);
             that._createAjaxSuccessFunction(options)();
             window.location.href = that._createUrl(base_url, task_id) + '&download=true';
         },
 
+        /**Phase 2. Server-Sent Events
+         * @param base_url
+         * @param task_id
+         * @param on_ready <function called when the task has finished>
+         * @param on_fallback <function called if events are not available>
+         * @private
+         */
+        _waitForTaskEvent: function(base_url, task_id, on_ready, on_fallback){
+            if(!window.EventSource){
+                on_fallback();
+                return;
+            }
+            var source = new EventSource(
+                this._createUrl(base_url, task_id) + '&events=true');
+            source.addEventListener('ready', function(){
+                source.close();
+                on_ready();
+            });
+            source.onerror = function(){
+                // CONNECTING: stream timed out and browser reconnects
+                // CLOSED: e.g. notifications are not configured in the server
+                if(source.readyState === EventSource.CLOSED){
+                    on_fallback();
+                }
+            };
+        },
+
+        // ======
+        // Cancel
+        // ======
+
+        /**Cancel the task, e.g. when the user closes a dialog
+         * # Phase 2. POST base_url?task_id=<task_id>&cancel=true
+         * @param base_url
+         * @param task_id
+         */
+        cancelTask: function(base_url, task_id){
+            this._untrackTask(task_id);
+            delete this._batch_tasks[task_id];
+            $.ajax({
+                url: this._createUrl(base_url, task_id) + '&cancel=true',
+                type: 'POST',
+                headers: {'X-CSRFToken': this._getCsrfToken()},
+                dataType: 'json',
+                timeout: 2000
+            });
+        },
+
+        /**
+         * @returns {string} value of the csrf_cookie_name cookie
+         * @private
+         */
+        _getCsrfToken: function(){
+            var cookies = document.cookie ? document.cookie.split(';') : [];
+            for(var i = 0; i < cookies.length; i++){
+                var cookie = $.trim(cookies[i]);
+                if(cookie.substring(0, this.csrf_cookie_name.length + 1) === this.csrf_cookie_name + '='){
+                    return decodeURIComponent(cookie.substring(this.csrf_cookie_name.length + 1));
+                }
+            }
+            return '';
+        },
+
+        /**Cancel the task if it is pending and cancellable
+         * @param task_id
+         * @private
+         */
+        _cancelPendingTask: function(task_id){
+            var base_url = this._pending_tasks[task_id];
+            if(base_url === undefined){
+                delete this._batch_tasks[task_id];
+                return;
+            }
+            this.cancelTask(base_url, task_id);
+        },
+
+        _trackTask: function(base_url, task_id){
+            this._pending_tasks[task_id] = base_url;
+        },
+
+        _untrackTask: function(task_id){
+            delete this._pending_tasks[task_id];
+        },
+
+        /**Cancel pending tasks when the page is left
+         * ajax is not reliable while unloading -> fetch keepalive
+         * (sendBeacon can not send the X-CSRFToken header)
+         * @private
+         */
+        _cancelPendingTasks: function(){
+            var that = this;
+            if(!that.cancel_on_unload){
+                return;
+            }
+            var headers = {'X-CSRFToken': that._getCsrfToken()};
+            $.each(that._pending_tasks, function(task_id, base_url){
+                var url = that._createUrl(base_url, task_id) + '&cancel=true';
+                if(window.fetch){
+                    window.fetch(url, {
+                        method: 'POST', keepalive: true, credentials: 'same-origin', headers: headers});
+                }else{
+                    $.ajax({url: url, type: 'POST', headers: headers, async: false});
+                }
+            });
+            that._pending_tasks = {};
+        },
+
+        // ============
+        // Batch status
+        // ============
+
+        _useBatch: function(options){
+            return !!this.batch_status_url && options.batch !== false && !options.long_poll;
+        },
+
+        /**Phase 2. Wait in the batch
+         * @param task_id
+         * @param max_polls
+         * @param on_ready <function called when the task has finished>
+         * @param on_error <function called if max_polls is reached>
+         * @param on_progress <function(status) called if the task reports progress>
+         * @private
+         */
+        _waitInBatch: function(task_id, max_polls, on_ready, on_error, on_progress){
+            this._batch_tasks[task_id] = {
+                poll_count: 0,
+                max_polls: max_polls,
+                on_ready: on_ready,
+                on_error: on_error,
+                on_progress: on_progress
+            };
+            this._scheduleBatchPoll();
+        },
+
+        _scheduleBatchPoll: function(delay){
+            var that = this;
+            if(that._batch_timeout !== null){
+                // already scheduled
+                return;
+            }
+            that._batch_timeout = setTimeout(function(){
+                that._batch_timeout = null;
+                that._batchPoll();
+            }, delay || that.batch_poll_interval);
+        },
+
+        /**Phase 2. One request for every pending task
+         * @private
+         */
+        _batchPoll: function(){
+            var that = this;
+            var task_ids = $.map(that._batch_tasks, function(task, task_id){
+                return task_id;
+            });
+            if(!task_ids.length){
+                return;
+            }
+            function handleTasks(statuses){
+                // the task that finishes first decides the next poll
+                var delay = null;
+                $.each(task_ids, function(i, task_id){
+                    var task = that._batch_tasks[task_id];
+                    if(task === undefined){
+                        // cancelled while polling
+                        return;
+                    }
+                    var status = statuses[task_id];
+                    task.poll_count += 1;
+                    if(status && status.ready){
+                        delete that._batch_tasks[task_id];
+                        task.on_ready();
+                        return;
+                    }
+                    if(status && task.on_progress){
+                        task.on_progress(status);
+                    }
+                    if(task.poll_count >= task.max_polls){
+                        // Poll limit reached
+                        delete that._batch_tasks[task_id];
+                        task.on_error();
+                        return;
+                    }
+                    var task_delay = that._adaptPollInterval(
+                        that.batch_poll_interval, status, {});
+                    if(delay === null || task_delay < delay){
+                        delay = task_delay;
+                    }
+                });
+                that._scheduleBatchPoll(delay);
+            }
+            var separator = that.batch_status_url.indexOf('?') < 0 ? '?' : '&';
+            $.ajax({
+                url: that.batch_status_url + separator + 'task_ids=' +
+                    encodeURIComponent(task_ids.join(',')),
+                type: 'GET',
+                success: function(data){
+                    handleTasks(data.tasks || {});
+                },
+                error: function(){
+                    // counted as not ready
+                    handleTasks({});
+                },
+                dataType: 'json',
+                timeout: 2000
+            });
+        },
+
         // =======
         // Helpers
         // =======
@@ -240,6 +577,62 @@ var AsyncViews = (function(){
             return base_url + 'task_id=' + task_id;
         },
 
+        /**Phase 2. url
+         * Adds long_poll=true if options.long_poll
+         * @param base_url
+         * @param task_id
+         * @param options
+         * @returns {string}
+         * @private
+         */
+        _createPollUrl: function(base_url, task_id, options){
+            var url = this._createUrl(base_url, task_id);
+            if(options && options.long_poll){
+                url += '&long_poll=true';
+            }
+            return url;
+        },
+
+        _getPollInterval: function(options){
+            if(options.poll_interval){
+                return options.poll_interval;
+            }
+            if(options.long_poll){
+                // server does the waiting
+                return this.long_poll_interval;
+            }
+            return [500, 2500, 10000];
+        },
+
+        /**Poll interval from the eta of the task
+         * @param poll_interval default interval (integer or array)
+         * @param data Phase 2. response
+         * @param options
+         * @returns poll_interval if the task has not reported eta
+         * @private
+         */
+        _adaptPollInterval: function(poll_interval, data, options){
+            if(!data || typeof(data.eta) !== 'number' || (options && options.long_poll)){
+                return poll_interval;
+            }
+            return Math.min(
+                Math.max(data.eta * 1000 * this.eta_poll_factor, this.min_poll_interval),
+                this.max_poll_interval);
+        },
+
+        _reportProgress: function(options, data){
+            if(options && options.progress && data.progress){
+                options.progress(data.progress, data.eta);
+            }
+        },
+
+        _getPollTimeout: function(options){
+            if(options && options.long_poll){
+                return options.long_poll_timeout || this.long_poll_timeout;
+            }
+            return 2000;
+        },
+
         /**Create callback that calls error and complete
          * if they exist.
          * @param options
@@ -287,6 +680,10 @@ var AsyncViews = (function(){
     };
 })();
 
+$(window).on('pagehide', function(){
+    AsyncViews._cancelPendingTasks();
+});
+
 $(document).on('ready async-view-rewrite', function(){
     $('body').on('click', '.' + AsyncViews.async_download_button_class, function(){
         var $download_button = $(this);
@@ -295,6 +692,10 @@ $(document).on('ready async-view-rewrite', function(){
         startFileCreationArguments.base_url = $download_button.attr('data-href');
         startFileCreationArguments.poll_interval = parseInt(
             $download_button.attr('data-poll-interval'));
+        startFileCreationArguments.long_poll = (
+            $download_button.attr('data-long-poll') === 'true');
+        startFileCreationArguments.events = (
+            $download_button.attr('data-events') === 'true');
         AsyncViews.startFileCreation(startFileCreationArguments);
     });
 
@@ -1,31 +1,203 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, unicode_literals
 import base64
+import errno
+import hashlib
+import os
+import uuid
 
 import six
 from db_file_storage.storage import FixedModelDatabaseFileStorage
+from django.conf import settings
+
+from django_celery_async_view.models import FORMAT_BASE64, FORMAT_BINARY, FORMAT_CHUNKED, \
+    FORMAT_FILESYSTEM, get_temp_file_root
+
+DEFAULT_TEMP_FILE_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+# Multiple of 3 so that the chunks can be base64 encoded independently
+ENCODE_CHUNK_SIZE = 3 * 64 * 1024
+
+# Resolved model classes by model_class_path
+_model_classes = {}
+
+
+def reset_model_classes():
+    """
+    Clears the model classes cached by TempFileDatabaseFileStorage._get_model_cls()
+    :return:
+    """
+    _model_classes.clear()
+
+
+class ContentDigest(object):
+    """
+    sha256 and size of the content that is written in chunks.
+    """
+
+    def __init__(self, data=b''):
+        self.hash = hashlib.sha256(data)
+        self.size = len(data)
+
+    def update(self, data):
+        """
+        :param data: chunk of the content
+        :return: data
+        """
+        self.hash.update(data)
+        self.size += len(data)
+        return data
+
+    def get_fields(self):
+        return {'content_hash': self.hash.hexdigest(), 'size': self.size}
 
 
 class TempFileDatabaseFileStorage(FixedModelDatabaseFileStorage):
 
-    def __init__(self, require_unique_filenames=False, *args, **kwargs):
+    def __init__(self, require_unique_filenames=False,
+                 storage_format=None, binary_field=None,
+                 chunk_model_class_path=None, chunk_size=None,
+                 *args, **kwargs):
+        """
+        :param require_unique_filenames:
+        :param storage_format: FORMAT_BASE64, FORMAT_BINARY or FORMAT_CHUNKED
+            defaults to settings.ASYNC_VIEW_TEMP_FILE_STORAGE_FORMAT
+        :param binary_field: field for FORMAT_BINARY content
+        :param chunk_model_class_path: model for FORMAT_CHUNKED content
+            Model has fields temp_file, index and data.
+        :param chunk_size: size of FORMAT_CHUNKED chunks
+            defaults to settings.ASYNC_VIEW_TEMP_FILE_CHUNK_SIZE
+        """
         self.require_unique_filenames = require_unique_filenames
+        if storage_format is None:
+            storage_format = getattr(
+                settings, 'ASYNC_VIEW_TEMP_FILE_STORAGE_FORMAT', FORMAT_BASE64)
+        if storage_format == FORMAT_BINARY and binary_field is None:
+            raise ValueError('binary_field is required with FORMAT_BINARY')
+        if storage_format == FORMAT_CHUNKED and chunk_model_class_path is None:
+            raise ValueError('chunk_model_class_path is required with FORMAT_CHUNKED')
+        if chunk_size is None:
+            chunk_size = getattr(
+                settings, 'ASYNC_VIEW_TEMP_FILE_CHUNK_SIZE', DEFAULT_TEMP_FILE_CHUNK_SIZE)
+        self.storage_format = storage_format
+        self.binary_field = binary_field
+        self.chunk_model_class_path = chunk_model_class_path
+        self.chunk_size = chunk_size
         super(TempFileDatabaseFileStorage, self).__init__(*args, **kwargs)
 
-    def _get_encoded_bytes_from_file(self, _file):
-        if isinstance(_file, six.string_types):
-            file_content = _file
+    def _get_model_cls(self, model_class_path):
+        """
+        Cached, apps.get_model() is called once per process and path.
+        """
+        try:
+            return _model_classes[model_class_path]
+        except KeyError:
+            model_cls = super(TempFileDatabaseFileStorage, self)._get_model_cls(
+                model_class_path)
+            _model_classes[model_class_path] = model_cls
+            return model_cls
+
+    def _iter_bytes_from_file(self, _file, chunk_size):
+        """
+        Yields the content in chunks of chunk_size bytes
+        without reading all of it into memory.
+        :param _file: string, file object or iterable of strings
+        :param chunk_size:
+        :return:
+        """
+        if isinstance(_file, (six.string_types, six.binary_type)):
+            file_content = self._get_bytes_from_file(_file)
+            for start in six.moves.range(0, len(file_content), chunk_size):
+                yield file_content[start:start + chunk_size]
+            return
+        if hasattr(_file, 'read'):
+            _file.seek(0)
+            parts = iter(lambda: _file.read(chunk_size), _file.read(0))
         else:
+            # e.g. generator returned by create_file
+            parts = _file
+        buffer = bytearray()
+        for part in parts:
+            buffer.extend(self._get_bytes_from_file(part))
+            while len(buffer) >= chunk_size:
+                yield bytes(buffer[:chunk_size])
+                del buffer[:chunk_size]
+        if buffer:
+            yield bytes(buffer)
+
+    def _save_chunks(self, temp_file, content):
+        """
+        :param temp_file:
+        :param content:
+        :return: content_hash and size fields
+        """
+        chunk_model_cls = self._get_model_cls(self.chunk_model_class_path)
+        digest = ContentDigest()
+        for index, data in enumerate(
+                self._iter_bytes_from_file(content, self.chunk_size)):
+            chunk_model_cls.objects.create(
+                temp_file=temp_file, index=index, data=digest.update(data))
+        return digest.get_fields()
+
+    def _get_bytes_from_file(self, _file):
+        if isinstance(_file, (six.string_types, six.binary_type)):
+            file_content = _file
+        elif hasattr(_file, 'read'):
             _file.seek(0)
             file_content = _file.read()
-        return base64.b64encode(file_content)
+        else:
+            # iterable of strings e.g. compressed chunks
+            return b''.join(self._get_bytes_from_file(part) for part in _file)
+        if isinstance(file_content, six.text_type):
+            file_content = file_content.encode('utf-8')
+        return file_content
+
+    def _get_encoded_bytes_from_file(self, _file, digest=None):
+        """
+        Encodes incrementally: the raw content is never in memory as a whole.
+        :param _file: string, file object or iterable of strings
+        :param digest: ContentDigest of the raw content (optional)
+        :return: base64 text
+        """
+        encoded_parts = []
+        for data in self._iter_bytes_from_file(_file, ENCODE_CHUNK_SIZE):
+            if digest is not None:
+                digest.update(data)
+            encoded_parts.append(base64.b64encode(data).decode('ascii'))
+        return ''.join(encoded_parts)
+
+    def _get_content_kwargs(self, content, content_field):
+        """
+        :param content:
+        :param content_field:
+        :return: model fields that store the content
+        """
+        if self.storage_format == FORMAT_CHUNKED:
+            # saved after the model object exists
+            return {}
+        if self.storage_format == FORMAT_BINARY:
+            # raw bytes, no base64 overhead
+            file_content = self._get_bytes_from_file(content)
+            content_kwargs = {self.binary_field: file_content}
+            content_kwargs.update(ContentDigest(file_content).get_fields())
+            return content_kwargs
+        digest = ContentDigest()
+        content_kwargs = {
+            content_field: self._get_encoded_bytes_from_file(content, digest)}
+        content_kwargs.update(digest.get_fields())
+        return content_kwargs
 
     def _save(self, name, content, user_id=None, mimetype=None, **create_kwargs):
         """
         Overrides to allow
             - support for user_id
+            - content_hash and size of the stored content
             - return new_model_object instead of new_filename
             - require_unique_filenames = False support
+            - storage_format = FORMAT_BINARY support
+            - storage_format = FORMAT_CHUNKED support
+                content can be an iterable of strings (e.g. generator)
+                and it is written chunk by chunk
         :param name:
         :param content:
         :return:
@@ -42,18 +214,59 @@ class TempFileDatabaseFileStorage(FixedModelDatabaseFileStorage):
                 model_cls, filename_field, name)
         else:
             new_filename = name
-        encoded_bytes = self._get_encoded_bytes_from_file(content)
+        create_kwargs.update(self._get_content_kwargs(content, content_field))
         if mimetype is None:
             mimetype = getattr(content.file, 'content_type', 'text/plain')
 
         create_kwargs.update({
-            content_field: encoded_bytes,
             filename_field: new_filename,
             mimetype_field: mimetype,
+            'storage_format': self.storage_format,
         })
         if user_id is not None:
             create_kwargs['user_id'] = user_id
 
         new_model_object = model_cls.objects.create(**create_kwargs)
+        if self.storage_format == FORMAT_CHUNKED:
+            # written after the model object exists
+            digest_fields = self._save_chunks(new_model_object, content)
+            model_cls.objects.filter(pk=new_model_object.pk).update(**digest_fields)
+            for field_name, value in digest_fields.items():
+                setattr(new_model_object, field_name, value)
         # return new_filename
         return new_model_object
+
+
+class TempFileFileSystemStorage(TempFileDatabaseFileStorage):
+    """
+    Stores the content into a file in settings.ASYNC_VIEW_TEMP_FILE_ROOT.
+    TempFile model still holds the metadata (user, filename, expiration)
+    and the file path relative to ASYNC_VIEW_TEMP_FILE_ROOT.
+
+    Enable with
+        ASYNC_VIEW_STORAGE_BACKEND = \
+            'django_celery_async_view.storage.TempFileFileSystemStorage'
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs['storage_format'] = FORMAT_FILESYSTEM
+        super(TempFileFileSystemStorage, self).__init__(*args, **kwargs)
+        # raises ImproperlyConfigured if the setting is missing
+        self.location = get_temp_file_root()
+
+    def _get_content_kwargs(self, content, content_field):
+        file_path = uuid.uuid4().hex
+        if not os.path.isdir(self.location):
+            try:
+                os.makedirs(self.location)
+            except OSError as e:
+                # created by other process
+                if e.errno != errno.EEXIST:
+                    raise
+        digest = ContentDigest()
+        with open(os.path.join(self.location, file_path), 'wb') as _file:
+            for data in self._iter_bytes_from_file(content, self.chunk_size):
+                _file.write(digest.update(data))
+        content_kwargs = {'file_path': file_path}
+        content_kwargs.update(digest.get_fields())
+        return content_kwargs
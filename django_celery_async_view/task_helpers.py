@@ -1,65 +1,433 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, unicode_literals
 
-import base64
-from copy import deepcopy
+import binascii
+import collections
+import itertools
+import multiprocessing
+import time
 from datetime import timedelta
 
+import six
+from celery import chord, current_task, group
+from celery.exceptions import Ignore
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from six.moves import range
 
-from django_celery_async_view.models import TempFile, DEFAULT_TEMP_FILE_DURATION_MS
-from django_celery_async_view.storage import TempFileDatabaseFileStorage
+from django_celery_async_view.compression import decompress as decompress_content, \
+    iter_compressed, iter_decompressed
+from django_celery_async_view.leases import TaskCancelled, is_task_cancelled
+from django_celery_async_view.progress import estimate_remaining, partition_done, \
+    set_progress, start_partitions
+from django_celery_async_view.tasks import create_file_partition, stitch_file_partitions
+from django_celery_async_view.models import TempFile, DEFAULT_TEMP_FILE_DURATION_MS, \
+    FORMAT_BINARY, FORMAT_CHUNKED, FORMAT_FILESYSTEM
+from django_celery_async_view.storage import reset_model_classes
 
+DEFAULT_STORAGE_BACKEND = 'django_celery_async_view.storage.TempFileDatabaseFileStorage'
 
-def create_storage():
-    return TempFileDatabaseFileStorage(
+# Changing these resets the storages cached by get_storage() (override_settings)
+STORAGE_SETTINGS = (
+    'ASYNC_VIEW_STORAGE_BACKEND', 'ASYNC_VIEW_TEMP_FILE_STORAGE_FORMAT',
+    'ASYNC_VIEW_TEMP_FILE_CHUNK_SIZE', 'ASYNC_VIEW_TEMP_FILE_ROOT',
+    'ASYNC_VIEW_CACHE_STORAGES', 'INSTALLED_APPS')
+
+# Storages by storage_format, see get_storage()
+_storages = {}
+
+# Larger use_db=False results are stored in TempFile
+# None: not limited, opt-in because the TempFiles must be deleted
+# (delete_old_temp_files periodic task)
+DEFAULT_RESULT_INLINE_MAX_SIZE = None
+
+# Multiple of 3 so that base64 chunks can be decoded independently
+STREAM_CHUNK_SIZE = 3 * 64 * 1024
+
+# Loaded in open_result_metadata(), content fields are deferred
+TEMP_FILE_METADATA_FIELDS = (
+    'user', 'filename', 'mimetype', 'storage_format', 'file_path', 'content_encoding',
+    'content_hash', 'size', 'created_datetime')
+
+
+def create_storage(storage_format=None):
+    """
+    :param storage_format: overrides settings.ASYNC_VIEW_TEMP_FILE_STORAGE_FORMAT
+    :return: storage defined in settings.ASYNC_VIEW_STORAGE_BACKEND
+    """
+    storage_cls = import_string(getattr(
+        settings, 'ASYNC_VIEW_STORAGE_BACKEND', DEFAULT_STORAGE_BACKEND))
+    storage_kwargs = {}
+    if storage_format is not None:
+        storage_kwargs['storage_format'] = storage_format
+    return storage_cls(
         model_class_path='django_celery_async_view.TempFile',
         content_field='bytes',
         filename_field='filename',
         mimetype_field='mimetype',
+        binary_field='binary',
+        chunk_model_class_path='django_celery_async_view.TempFileChunk',
+        **storage_kwargs
     )
 
 
-def open_result(result):
+def get_storage(storage_format=None):
+    """
+    Process level cache of create_storage(), the storages do not have state.
+    Disable with settings.ASYNC_VIEW_CACHE_STORAGES = False
+    :param storage_format: overrides settings.ASYNC_VIEW_TEMP_FILE_STORAGE_FORMAT
+    :return: storage defined in settings.ASYNC_VIEW_STORAGE_BACKEND
+    """
+    if not getattr(settings, 'ASYNC_VIEW_CACHE_STORAGES', True):
+        return create_storage(storage_format)
+    try:
+        return _storages[storage_format]
+    except KeyError:
+        storage = _storages[storage_format] = create_storage(storage_format)
+        return storage
+
+
+def reset_storages():
+    """
+    Clears the storages and model classes cached in this process.
+    Called when STORAGE_SETTINGS change.
+    :return:
+    """
+    _storages.clear()
+    reset_model_classes()
+
+
+@receiver(setting_changed)
+def _reset_storages_on_setting_changed(setting, **kwargs):
+    if setting in STORAGE_SETTINGS:
+        reset_storages()
+
+
+def read_inline_content(chunks, max_size):
+    """
+    Reads chunks until max_size is exceeded.
+    :param chunks: iterator of bytes
+    :param max_size:
+    :return: (content, None) if the content fits in max_size
+        else (None, iterator of all chunks)
+    """
+    read_chunks = []
+    size = 0
+    for chunk in chunks:
+        read_chunks.append(chunk)
+        size += len(chunk)
+        if size > max_size:
+            return None, itertools.chain(read_chunks, chunks)
+    return b''.join(read_chunks), None
+
+
+def _encoded_chunk_size(chunk_size):
+    # base64 encodes every 3 bytes into 4 characters
+    return max(chunk_size // 3, 1) * 4
+
+
+def b64decode(encoded):
+    """
+    Like base64.b64decode but does not copy ascii text or buffers before decoding.
+    :param encoded: base64 text, bytes or memoryview
+    :return: decoded bytes
+    """
+    return binascii.a2b_base64(encoded)
+
+
+def iter_decoded_chunks(encoded, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Decodes base64 string incrementally.
+    :param encoded: base64 encoded content
+    :param chunk_size: size of the decoded chunks
+    :return: generator of decoded chunks
+    """
+    if isinstance(encoded, bytes):
+        # slices of memoryview are not copies
+        encoded = memoryview(encoded)
+    encoded_chunk_size = _encoded_chunk_size(chunk_size)
+    for start in range(0, len(encoded), encoded_chunk_size):
+        yield b64decode(encoded[start:start + encoded_chunk_size])
+
+
+def iter_temp_file_chunks(temp_file, chunk_size=STREAM_CHUNK_SIZE, start=0, stop=None):
+    """
+    Reads and decodes TempFile content chunk by chunk from the database.
+    :param temp_file: TempFile, content fields can be deferred
+    :param chunk_size: size of the decoded chunks
+    :param start: position of the first byte
+    :param stop: position after the last byte, None reads to the end
+    :return: generator of decoded chunks
+    """
+    chunks = _iter_temp_file_chunks_from(temp_file, chunk_size, start)
+    if stop is None:
+        for chunk in chunks:
+            yield chunk
+        return
+    remaining = stop - start
+    for chunk in chunks:
+        if remaining <= 0:
+            return
+        if len(chunk) > remaining:
+            chunk = chunk[:remaining]
+        remaining -= len(chunk)
+        yield chunk
+
+
+def _iter_temp_file_chunks_from(temp_file, chunk_size, start):
+    if temp_file.storage_format == FORMAT_BINARY:
+        for chunk in TempFile.objects.iter_binary_chunks(temp_file.id, chunk_size, start):
+            yield chunk
+        return
+    if temp_file.storage_format == FORMAT_CHUNKED:
+        # stored chunk size is used
+        for chunk in TempFile.objects.iter_chunks(temp_file.id, start):
+            yield chunk
+        return
+    if temp_file.storage_format == FORMAT_FILESYSTEM:
+        with open(temp_file.get_file_path(), 'rb') as _file:
+            _file.seek(start)
+            for chunk in iter(lambda: _file.read(chunk_size), b''):
+                yield chunk
+        return
+    # base64 is decoded in groups of 3 bytes (4 characters)
+    skip = start % 3
+    encoded_chunks = TempFile.objects.iter_encoded_chunks(
+        temp_file.id, _encoded_chunk_size(chunk_size), start=(start - skip) // 3 * 4)
+    for encoded_chunk in encoded_chunks:
+        chunk = b64decode(encoded_chunk)
+        if skip:
+            chunk = chunk[skip:]
+            skip = 0
+        yield chunk
+
+
+def get_temp_file_content(temp_file):
     """
+    :param temp_file: TempFile
+    :return: decoded content
+    """
+    if temp_file.storage_format == FORMAT_BINARY:
+        return bytes(temp_file.binary)
+    if temp_file.storage_format == FORMAT_CHUNKED:
+        return b''.join(TempFile.objects.iter_chunks(temp_file.id))
+    if temp_file.storage_format == FORMAT_FILESYSTEM:
+        with open(temp_file.get_file_path(), 'rb') as _file:
+            return _file.read()
+    return b64decode(temp_file.bytes)
+
+
+class OpenedResult(object):
+    """
+    Opened task result.
+    Content is not copied, only decoded once.
+    Supports also dict-style access e.g. opened_result['user_id'].
+    """
+    __slots__ = ('content', 'user_id', 'filename', 'mimetype', 'file_path', 'source',
+                 'content_encoding', 'content_hash', 'size', 'last_modified')
+
+    def __init__(self, user_id, filename, mimetype, source,
+                 file_path=None, content=None, content_encoding='',
+                 content_hash='', size=None, last_modified=None):
+        """
+        :param user_id:
+        :param filename:
+        :param mimetype:
+        :param source: result dict or TempFile with deferred content
+        :param file_path: absolute path of the file if FORMAT_FILESYSTEM
+        :param content: decoded content or generator of decoded chunks
+            set by load_result_content()
+        :param content_encoding: compression of the content e.g. 'gzip'
+            '' after load_result_content() has decompressed the content
+        :param content_hash: sha256 of the stored content (TempFile)
+        :param size: size of the stored content (TempFile)
+        :param last_modified: datetime (TempFile)
+        """
+        self.user_id = user_id
+        self.filename = filename
+        self.mimetype = mimetype
+        self.source = source
+        self.file_path = file_path
+        self.content = content
+        self.content_encoding = content_encoding
+        self.content_hash = content_hash
+        self.size = size
+        self.last_modified = last_modified
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
 
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+
+def open_result(result, stream=False, chunk_size=STREAM_CHUNK_SIZE, decompress=True):
+    """
+    Opens metadata and content at once.
+    Use open_result_metadata() and load_result_content() to load the content
+    only after e.g. permission check.
     :param result:
-    :return: opened_result = {
-            'content': <decoded file content>,
-            'user_id': <user_id>,
-            'filename': <filename>,
-            'mimetype': <mimetype>,
-        }
+    :param stream: if True content is generator of decoded chunks
+        and content is read lazily
+    :param chunk_size: used if stream=True
+    :param decompress: see load_result_content()
+    :return: OpenedResult
+    """
+    opened_result = open_result_metadata(result)
+    if opened_result is None:
+        return None
+    return load_result_content(
+        opened_result, stream=stream, chunk_size=chunk_size, decompress=decompress)
+
+
+def open_result_metadata(result):
+    """
+    Metadata phase. Content is not loaded.
+    :param result:
+    :return: OpenedResult without content
     """
     if result is None:
         return None
     if type(result) is dict:
-        opened_result = deepcopy(result)
+        return OpenedResult(
+            user_id=result['user_id'],
+            filename=result['filename'],
+            mimetype=result['mimetype'],
+            source=result,
+            content_encoding=result.get('content_encoding', ''),
+        )
+    temp_file = TempFile.objects.only(*TEMP_FILE_METADATA_FIELDS).get(id=result)
+    if temp_file.storage_format == FORMAT_FILESYSTEM:
+        file_path = temp_file.get_file_path()
     else:
-        temp_file = TempFile.objects.get(id=result)
-        opened_result = {
-            'content': temp_file.bytes,
-            'user_id': temp_file.user_id,
-            'filename': temp_file.filename,
-            'mimetype': temp_file.mimetype,
-        }
-    opened_result['content'] = base64.b64decode(opened_result['content'])
+        file_path = None
+    return OpenedResult(
+        user_id=temp_file.user_id,
+        filename=temp_file.filename,
+        mimetype=temp_file.mimetype,
+        source=temp_file,
+        file_path=file_path,
+        content_encoding=temp_file.content_encoding,
+        content_hash=temp_file.content_hash,
+        size=temp_file.size,
+        last_modified=temp_file.created_datetime,
+    )
+
+
+def load_result_content(opened_result, stream=False, chunk_size=STREAM_CHUNK_SIZE,
+                        decompress=True, byte_range=None):
+    """
+    Payload phase. Loads the content of open_result_metadata() result.
+    :param opened_result:
+    :param stream: if True content is generator of decoded chunks
+        and content is read lazily
+    :param chunk_size: used if stream=True
+    :param decompress: if False compressed content is left compressed
+        (opened_result.content_encoding) e.g. to send it with Content-Encoding
+    :param byte_range: (start, stop) of the stored content, only TempFile results
+        Only the range is read. Content is not decompressed.
+    :return: opened_result with content
+    """
+    source = opened_result.source
+    if byte_range is not None:
+        start, stop = byte_range
+        content = iter_temp_file_chunks(source, chunk_size, start, stop)
+        if not stream:
+            content = b''.join(content)
+        opened_result.content = content
+        # the file has the whole content
+        opened_result.file_path = None
+        return opened_result
+    if type(source) is dict:
+        # circular import
+        from django_celery_async_view.payload_codecs import CODEC_BASE64, get_payload_codec
+        codec = get_payload_codec(source.get('payload_codec', CODEC_BASE64))
+        if stream:
+            content = codec.iter_decoded(source['content'], chunk_size)
+        else:
+            content = codec.decode(source['content'])
+    elif stream:
+        content = iter_temp_file_chunks(source, chunk_size)
+    else:
+        # loads only the deferred content field
+        content = get_temp_file_content(source)
+    if decompress and opened_result.content_encoding:
+        if stream:
+            content = iter_decompressed(content, opened_result.content_encoding)
+        else:
+            content = decompress_content(content, opened_result.content_encoding)
+        opened_result.content_encoding = ''
+        # the file has compressed content
+        opened_result.file_path = None
+    opened_result.content = content
     return opened_result
 
 
 class AbstractAsyncDownloadCreateFile(object):
     description = ''
     use_db = True
+    # Compress the content on save: None, 'gzip' or 'deflate'
+    # Compressed content is sent with Content-Encoding if the client accepts it.
+    compression = None
+    # How the content is stored in the result if use_db=False
+    #   'base64' (default), 'raw' (pickle / msgpack result serializer) or 'temp_file'
+    #   see django_celery_async_view.payload_codecs
+    payload_codec = 'base64'
+    # If use_db=False content larger than this (bytes) is stored in TempFile
+    # and the result is only the TempFile id.
+    # Defaults to settings.ASYNC_VIEW_RESULT_INLINE_MAX_SIZE (default None: not limited)
+    inline_max_size = None
+    # TempFile storage format of this task, defaults to
+    # settings.ASYNC_VIEW_TEMP_FILE_STORAGE_FORMAT
+    # 'chunked' (or TempFileFileSystemStorage) writes generator content
+    # chunk by chunk with constant memory, 'base64' and 'binary' store the
+    # content in one field so it is in memory as a whole.
+    storage_format = None
+    # Partitioned mode, see get_partitions()
+    # In the partition tasks id of the task that started the partitions
+    root_task_id = None
+    # Seconds between the cache reads of check_cancelled()
+    cancel_check_interval = 1.0
+    # Seconds between the cache writes of report_progress()
+    progress_interval = 1.0
+    # map_chunks() pool: 'thread' or 'process' and its size (None: cpu count)
+    map_chunks_executor = 'thread'
+    map_chunks_max_workers = None
 
-    def __init__(self, description=None, use_db=None):
+    def __init__(self, description=None, use_db=None, compression=None,
+                 payload_codec=None):
         if description is not None:
             self.description = description
         if use_db is not None:
             self.use_db = use_db
+        if compression is not None:
+            self.compression = compression
+        if payload_codec is not None:
+            self.payload_codec = payload_codec
+        self._cancel_checked_at = None
+        self._progress_reported_at = None
+        self._progress_stage = None
+        # (time, percent) of the first report, used for the eta
+        self._progress_start = None
 
     def create_file(self, *args, **kwargs):
         """
-
+        _file can be
+            string (bytes or text)
+            file object
+            iterable of strings e.g. generator that yields rows
+                Consumed once, chunk by chunk: compressed, encoded and
+                written incrementally (see storage_format).
+        Text is encoded as utf-8.
         :param args:
         :param kwargs:
         :return: _file, filename, mimetype
@@ -69,23 +437,18 @@ class AbstractAsyncDownloadCreateFile(object):
     def run_use_result_backend(self, user_id,
                                *create_file_args,
                                **create_file_kwargs):
+        self.check_cancelled(force=True)
         _file, filename, mimetype = self.create_file(
             *create_file_args,
             **create_file_kwargs
         )
-        encoded_file = create_storage()._get_encoded_bytes_from_file(_file)
-        return {
-            'content': encoded_file,
-            'user_id': user_id,
-            'filename': filename,
-            'mimetype': mimetype,
-        }
+        return self.save_file_to_result_backend(user_id, _file, filename, mimetype)
 
     def run_use_db(self, user_id,
                    *create_file_args,
                    **create_file_kwargs):
         """
-        # 1) Delete all too old files
+        # 1) Delete all too old files (if ASYNC_VIEW_DELETE_OLD_FILES_IN_TASK)
         # 2) Create file
         # 3) Save file to database
         :param user_id:
@@ -94,25 +457,103 @@ class AbstractAsyncDownloadCreateFile(object):
         :return:
         """
         # 1) Delete all too old files
-        TempFile.objects.delete_old_files()
+        # By default this is done by delete_old_temp_files periodic task
+        # or management command instead.
+        if getattr(settings, 'ASYNC_VIEW_DELETE_OLD_FILES_IN_TASK', False):
+            TempFile.objects.delete_old_files()
         # 2) Create file
+        self.check_cancelled(force=True)
         _file, filename, mimetype = self.create_file(
             *create_file_args,
             **create_file_kwargs
         )
         # 3) Save file to database
-        storage = create_storage()
+        return self.save_file_to_db(user_id, _file, filename, mimetype)
+
+    def save_file(self, user_id, _file, filename, mimetype):
+        """
+        :param user_id:
+        :param _file: create_file() content
+        :param filename:
+        :param mimetype:
+        :return: result of the task
+        """
+        if self.use_db:
+            return self.save_file_to_db(user_id, _file, filename, mimetype)
+        return self.save_file_to_result_backend(user_id, _file, filename, mimetype)
+
+    def save_file_to_db(self, user_id, _file, filename, mimetype):
+        """
+        :return: TempFile id
+        """
+        _file = self.iter_checking_cancelled(_file)
+        storage = get_storage(self.storage_format)
+        return self.save_temp_file(
+            storage, self.compress_file(storage, _file), user_id, filename, mimetype)
+
+    def save_file_to_result_backend(self, user_id, _file, filename, mimetype):
+        """
+        :return: dict with the encoded content or TempFile id if the content is too large
+        """
+        _file = self.iter_checking_cancelled(_file)
+        # circular import
+        from django_celery_async_view.payload_codecs import CODEC_TEMP_FILE, \
+            get_payload_codec
+        storage = get_storage(self.storage_format)
+        content = self.compress_file(storage, _file)
+        inline_max_size = self.get_inline_max_size()
+        if inline_max_size is not None and self.payload_codec != CODEC_TEMP_FILE:
+            content, spilled_chunks = read_inline_content(
+                storage._iter_bytes_from_file(content, storage.chunk_size),
+                inline_max_size)
+            if content is None:
+                # Too large for the result backend, result is only the TempFile id
+                return self.save_temp_file(
+                    storage, spilled_chunks, user_id, filename, mimetype)
+        encoded_file = get_payload_codec(self.payload_codec).encode(
+            content, {
+                'user_id': user_id,
+                'filename': filename,
+                'mimetype': mimetype,
+                'description': self.description,
+                'duration': self.get_tempfile_duration(),
+                'content_encoding': self.compression or '',
+                'storage_format': self.storage_format,
+            })
+        return {
+            'content': encoded_file,
+            'payload_codec': self.payload_codec,
+            'content_encoding': self.compression or '',
+            'user_id': user_id,
+            'filename': filename,
+            'mimetype': mimetype,
+        }
+
+    def save_temp_file(self, storage, content, user_id, filename, mimetype):
+        """
+        :param storage:
+        :param content: compressed content
+        :param user_id:
+        :param filename:
+        :param mimetype:
+        :return: TempFile id
+        """
         new_temp_file = storage._save(
-            name=filename, content=_file,
+            name=filename, content=content,
             user_id=user_id, mimetype=mimetype,
             description=self.description,
-            duration=self.get_tempfile_duration()
+            duration=self.get_tempfile_duration(),
+            content_encoding=self.compression or ''
         )
         return new_temp_file.id
 
     def run(self, user_id,
             *create_file_args,
             **create_file_kwargs):
+        partitions = self.get_partitions(*create_file_args, **create_file_kwargs)
+        if partitions:
+            return self.run_partitioned(
+                user_id, partitions, create_file_args, create_file_kwargs)
         if self.use_db:
             return self.run_use_db(
                 user_id,
@@ -124,8 +565,270 @@ class AbstractAsyncDownloadCreateFile(object):
                 *create_file_args,
                 **create_file_kwargs)
 
+    def get_partitions(self, *args, **kwargs):
+        """
+        Partitioned mode
+        Return json serializable partitions (e.g. pk ranges) and implement
+        create_partition(). The partitions are created in parallel (celery chord)
+        and stitched into one file in order by a task that has the task_id of
+        this task, so Phase 2. polls the task_id as usual.
+        :param args: create_file args
+        :param kwargs: create_file kwargs
+        :return: list of partitions, None or empty: create_file() is used
+        """
+        return None
+
+    def create_partition(self, index, partition, *args, **kwargs):
+        """
+        :param index: index of the partition
+        :param partition: item of get_partitions()
+        :param args: create_file args
+        :param kwargs: create_file kwargs
+        :return: _file, filename, mimetype of the partition
+        """
+        raise NotImplementedError('Implement this when get_partitions() is implemented.')
+
+    def get_init_kwargs(self):
+        """
+        :return: __init__ kwargs used to create this in the partition tasks
+        """
+        return {
+            'description': self.description,
+            'use_db': self.use_db,
+            'compression': self.compression,
+            'payload_codec': self.payload_codec,
+        }
+
+    def run_partitioned(self, user_id, partitions, create_file_args, create_file_kwargs):
+        """
+        Starts the partition tasks and the stitching task (chord) and
+        raises Ignore so that the stitching task stores the result of this task.
+        Outside of a worker (eager) the partitions are created one after another.
+        :param user_id:
+        :param partitions: get_partitions()
+        :param create_file_args:
+        :param create_file_kwargs:
+        :return:
+        """
+        task_id = self.get_task_id()
+        if task_id is None or current_task.request.is_eager:
+            first_file, filename, mimetype = self.create_partition(
+                0, partitions[0], *create_file_args, **create_file_kwargs)
+            return self.save_file(user_id, self._iter_partitions_content(
+                first_file, partitions, create_file_args, create_file_kwargs),
+                filename, mimetype)
+        create_file_path = '{}.{}'.format(type(self).__module__, type(self).__name__)
+        init_kwargs = self.get_init_kwargs()
+        start_partitions(task_id)
+        header = group(
+            create_file_partition.s(
+                create_file_path, init_kwargs, task_id, index, partition,
+                len(partitions), list(create_file_args), create_file_kwargs)
+            for index, partition in enumerate(partitions))
+        chord(header)(
+            stitch_file_partitions.s(create_file_path, init_kwargs, user_id),
+            task_id=task_id)
+        raise Ignore()
+
+    def _iter_partitions_content(self, first_file, partitions,
+                                 create_file_args, create_file_kwargs):
+        storage = get_storage()
+        for index, partition in enumerate(partitions):
+            if index == 0:
+                _file = first_file
+            else:
+                _file = self.create_partition(
+                    index, partition, *create_file_args, **create_file_kwargs)[0]
+            for chunk in storage._iter_bytes_from_file(_file, storage.chunk_size):
+                yield chunk
+
+    def run_partition(self, root_task_id, index, partition, partition_count,
+                      create_file_args, create_file_kwargs):
+        """
+        Partition task
+        :return: TempFile id of the uncompressed partition
+        """
+        self.root_task_id = root_task_id
+        self.check_cancelled(force=True)
+        _file, filename, mimetype = self.create_partition(
+            index, partition, *create_file_args, **create_file_kwargs)
+        temp_file = get_storage(FORMAT_CHUNKED)._save(
+            name=filename, content=self.iter_checking_cancelled(_file),
+            mimetype=mimetype, description=self.description,
+            duration=self.get_tempfile_duration())
+        partition_done(root_task_id, partition_count)
+        return temp_file.id
+
+    def stitch_partitions(self, user_id, part_ids):
+        """
+        Stitching task, has the task_id of the task that started the partitions
+        :param user_id:
+        :param part_ids: TempFile ids of the partitions in order
+        :return: result of the task
+        """
+        temp_files = TempFile.objects.only(*TEMP_FILE_METADATA_FIELDS).in_bulk(part_ids)
+        parts = [temp_files[part_id] for part_id in part_ids]
+        self.report_progress(stage='stitching', force=True)
+        content = itertools.chain.from_iterable(
+            iter_temp_file_chunks(part) for part in parts)
+        try:
+            return self.save_file(user_id, content, parts[0].filename, parts[0].mimetype)
+        finally:
+            TempFile.objects.delete_files(part_ids)
+
+    def get_task_id(self):
+        """
+        :return: id of the running celery task, None if called directly (eager)
+            In the partition tasks id of the task that started the partitions.
+        """
+        if self.root_task_id is not None:
+            return self.root_task_id
+        request = getattr(current_task, 'request', None)
+        return getattr(request, 'id', None)
+
+    def check_cancelled(self, force=False):
+        """
+        Raises TaskCancelled if the task has been cancelled or its lease has expired
+        (the client has stopped polling, see _BaseView.lease_timeout).
+        Called before create_file() and between the chunks of generator content.
+        Call in long running create_file() to stop early.
+        :param force: check even if cancel_check_interval has not passed
+        :return:
+        """
+        task_id = self.get_task_id()
+        if task_id is None:
+            return
+        now = time.time()
+        if not force and self._cancel_checked_at is not None \
+                and now - self._cancel_checked_at < self.cancel_check_interval:
+            return
+        self._cancel_checked_at = now
+        if is_task_cancelled(task_id):
+            raise TaskCancelled(task_id)
+
+    def report_progress(self, current=None, total=None, stage=None, percent=None,
+                        force=False):
+        """
+        Reports the progress of create_file() to Phase 2. responses
+        (django_celery_async_view.progress). Cheap to call for every row:
+        written at most once per progress_interval unless the stage changes.
+        :param current: e.g. rows processed
+        :param total: e.g. rows in total
+        :param stage: e.g. 'query', 'rows', 'saving'
+        :param percent: 0-100, defaults to current / total
+        :param force: write even if progress_interval has not passed
+        :return:
+        """
+        if self.root_task_id is not None:
+            # partitions report when they are done
+            return
+        task_id = self.get_task_id()
+        if task_id is None:
+            return
+        now = time.time()
+        if not force and stage == self._progress_stage \
+                and self._progress_reported_at is not None \
+                and now - self._progress_reported_at < self.progress_interval:
+            return
+        self._progress_reported_at = now
+        self._progress_stage = stage
+        if percent is None and current is not None and total:
+            percent = 100.0 * current / total
+        if self._progress_start is None or self._progress_start[1] is None:
+            self._progress_start = (now, percent)
+        started_at, started_percent = self._progress_start
+        set_progress(task_id, {
+            'percent': percent,
+            'current': current,
+            'total': total,
+            'stage': stage,
+        }, eta=estimate_remaining(started_at, started_percent, percent, now))
+
+    def map_chunks(self, func, items, executor=None, max_workers=None, prefetch=None):
+        """
+        Calls func(item) for the items in a concurrent.futures pool and yields
+        the results in order, e.g. return it as create_file() content.
+        At most prefetch items are submitted ahead of the yielded result,
+        so the memory is bounded also when the content is consumed slowly.
+        With 'process' func, items and results must be picklable (module level func)
+        and the celery worker pool must allow child processes (e.g. --pool=solo).
+        Requires futures package in Python 2.
+        :param func: function that returns a chunk (string) of the content
+        :param items: iterable of func arguments
+        :param executor: 'thread' or 'process', defaults to self.map_chunks_executor
+        :param max_workers: defaults to self.map_chunks_max_workers or cpu count
+        :param prefetch: defaults to 2 * max_workers
+        :return: generator of func results
+        """
+        from concurrent import futures
+        executor = executor or self.map_chunks_executor
+        if executor == 'process':
+            executor_cls = futures.ProcessPoolExecutor
+        elif executor == 'thread':
+            executor_cls = futures.ThreadPoolExecutor
+        else:
+            raise ValueError('Unknown executor: {}'.format(executor))
+        max_workers = max_workers or self.map_chunks_max_workers or multiprocessing.cpu_count()
+        prefetch = prefetch or 2 * max_workers
+        total = len(items) if hasattr(items, '__len__') else None
+        return self._map_chunks(
+            executor_cls(max_workers), func, iter(items), total, prefetch)
+
+    def _map_chunks(self, pool, func, items, total, prefetch):
+        with pool:
+            pending = collections.deque(
+                pool.submit(func, item) for item in itertools.islice(items, prefetch))
+            try:
+                done = 0
+                while pending:
+                    result = pending.popleft().result()
+                    for item in itertools.islice(items, 1):
+                        pending.append(pool.submit(func, item))
+                    done += 1
+                    self.check_cancelled()
+                    self.report_progress(current=done, total=total, stage='chunks')
+                    yield result
+            finally:
+                # cancelled, failed or not consumed
+                for future in pending:
+                    future.cancel()
+
+    def iter_checking_cancelled(self, _file):
+        """
+        :param _file: create_file() content
+        :return: generator content checks cancellation between the chunks
+        """
+        if isinstance(_file, (six.string_types, six.binary_type)) or hasattr(_file, 'read'):
+            return _file
+        return self._iter_checking_cancelled(_file)
+
+    def _iter_checking_cancelled(self, chunks):
+        for chunk in chunks:
+            self.check_cancelled()
+            yield chunk
+
+    def compress_file(self, storage, _file):
+        """
+        :param storage:
+        :param _file: create_file() content
+        :return: generator of compressed chunks if self.compression else _file
+        """
+        if not self.compression:
+            return _file
+        return iter_compressed(
+            storage._iter_bytes_from_file(_file, storage.chunk_size), self.compression)
+
+    def get_inline_max_size(self):
+        """
+        :return: max size of content in the result or None if not limited
+        """
+        if self.inline_max_size is not None:
+            return self.inline_max_size
+        return getattr(
+            settings, 'ASYNC_VIEW_RESULT_INLINE_MAX_SIZE', DEFAULT_RESULT_INLINE_MAX_SIZE)
+
     def get_tempfile_duration(self):
-        return timedelta(getattr(
+        return timedelta(milliseconds=getattr(
             settings, 'ASYNC_VIEW_TEMP_FILE_DURATION_MS', DEFAULT_TEMP_FILE_DURATION_MS))
 
 
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from celery import states
+
+
+def get_task_states(task_ids, backend):
+    """
+    States of many tasks with one result backend query.
+        database backends (TaskModel e.g. djcelery, django-celery-results):
+            task_id__in query
+        key-value backends (redis, memcached, ...): MGET
+        other backends: one query per task
+    :param task_ids:
+    :param backend: celery result backend e.g. app.backend
+    :return: {task_id: state}, unknown tasks are PENDING
+    """
+    task_ids = list(task_ids)
+    task_states = dict.fromkeys(task_ids, states.PENDING)
+    task_model = getattr(backend, 'TaskModel', None)
+    if task_model is not None:
+        task_states.update(
+            task_model._default_manager.filter(
+                task_id__in=task_ids
+            ).values_list('task_id', 'status'))
+        return task_states
+    try:
+        keys = [backend.get_key_for_task(task_id) for task_id in task_ids]
+        values = backend.mget(keys)
+    except (AttributeError, NotImplementedError):
+        for task_id in task_ids:
+            task_states[task_id] = backend.get_status(task_id)
+        return task_states
+    if hasattr(values, 'items'):
+        # e.g. memcached client returns dict
+        values = [values.get(key) for key in keys]
+    for task_id, value in zip(task_ids, values):
+        if value is not None:
+            task_states[task_id] = backend.decode_result(value)['status']
+    return task_states
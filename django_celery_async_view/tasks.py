@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from celery import shared_task
+from django.utils.module_loading import import_string
+
+from django_celery_async_view.models import TempFile
+
+DEFAULT_DELETE_BATCH_SIZE = 1000
+
+
+@shared_task
+def delete_old_temp_files(batch_size=DEFAULT_DELETE_BATCH_SIZE):
+    """
+    Periodic task that deletes expired TempFiles.
+    Add to CELERYBEAT_SCHEDULE.
+    :param batch_size:
+    :return: number of deleted TempFiles
+    """
+    return TempFile.objects.delete_old_files(batch_size=batch_size)
+
+
+@shared_task
+def create_file_partition(create_file_path, init_kwargs, root_task_id, index, partition,
+                          partition_count, create_file_args, create_file_kwargs):
+    """
+    Partitioned mode (AbstractAsyncDownloadCreateFile.get_partitions)
+    Creates one partition.
+    :param create_file_path: dotted path of AbstractAsyncDownloadCreateFile subclass
+    :param init_kwargs: its __init__ kwargs
+    :param root_task_id: task that started the partitions
+    :param index:
+    :param partition:
+    :param partition_count:
+    :param create_file_args:
+    :param create_file_kwargs:
+    :return: TempFile id of the partition
+    """
+    return import_string(create_file_path)(**init_kwargs).run_partition(
+        root_task_id, index, partition, partition_count,
+        create_file_args, create_file_kwargs)
+
+
+@shared_task
+def stitch_file_partitions(part_ids, create_file_path, init_kwargs, user_id):
+    """
+    Partitioned mode
+    Chord body that stitches the partitions into one file.
+    Has the task_id of the task that started the partitions.
+    :param part_ids: TempFile ids of the partitions in order
+    :param create_file_path: dotted path of AbstractAsyncDownloadCreateFile subclass
+    :param init_kwargs: its __init__ kwargs
+    :param user_id:
+    :return: result of the task
+    """
+    return import_string(create_file_path)(**init_kwargs).stitch_partitions(
+        user_id, part_ids)
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+from django.conf.urls import url
+
+from django_celery_async_view.views import BatchStatusView
+
+urlpatterns = [
+    url(r'^status/$', BatchStatusView.as_view(), name='async_view_batch_status'),
+]
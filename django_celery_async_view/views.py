@@ -1,28 +1,104 @@
 # -*- coding: utf-8
 from __future__ import absolute_import, unicode_literals
+import os
+import time
+
+import six
+from celery import current_app, states
+from celery.utils import uuid
+from django.conf import settings
 from django.core.exceptions import PermissionDenied
-from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse
+from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse, \
+    HttpResponseNotAllowed, HttpResponseNotModified, StreamingHttpResponse, FileResponse
+from django.middleware.csrf import get_token
 from django.shortcuts import render
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
 try:
     from django.views import View
 except ImportError:
     from django.views.generic import View
 
 
-from django_celery_async_view.task_helpers import open_result
+from django_celery_async_view import leases
+from django_celery_async_view.cache import get_cache, make_key
+from django_celery_async_view.compression import accepts_encoding
+from django_celery_async_view.http_utils import RANGE_NOT_SATISFIABLE, is_not_modified, \
+    parse_range_header, quote_etag, timestamp
+from django_celery_async_view.models import get_temp_file_root
+from django_celery_async_view.notifications import get_notification_backend
+from django_celery_async_view.progress import get_many_progress, get_progress
+from django_celery_async_view.task_status import get_task_states
+from django_celery_async_view.task_helpers import open_result_metadata, load_result_content, \
+    STREAM_CHUNK_SIZE
+
+
+# query parameters of the three phases
+PROTOCOL_PARAMS = ('task_id', 'download', 'long_poll', 'events', 'cancel')
+
+# seconds the html cache key of a task is kept (Phase 1. -> Phase 3.)
+TASK_HTML_CACHE_KEY_TIMEOUT = 60 * 60
 
 
 class _BaseView(View):
     allow_no_user = True
 
+    # Phase 2. long polling
+    # If the request has long_poll=true the response is delayed
+    # until the task is ready or long_poll_timeout (seconds) has passed.
+    # Note: each waiting request reserves a worker (thread).
+    long_poll_timeout = 20
+    # Without ASYNC_VIEW_NOTIFICATION_BACKEND the result backend is polled,
+    # the interval grows from long_poll_interval by long_poll_backoff
+    # up to long_poll_max_interval (seconds)
+    long_poll_interval = 0.5
+    long_poll_backoff = 1.5
+    long_poll_max_interval = 5
+
+    # Phase 2. Server-Sent Events
+    # If the request has events=true the response is text/event-stream
+    # and "ready" event is sent when the task has finished.
+    # Requires settings.ASYNC_VIEW_NOTIFICATION_BACKEND
+    # Stream is closed after event_stream_timeout (seconds)
+    # and the browser (EventSource) reconnects.
+    event_stream_timeout = 25
+
+    # Phase 1. deduplication
+    # If dedup = True identical requests (same task, args and user) attach to
+    # the in-flight or recently finished task instead of starting a new one.
+    # Requires cache that is shared by web processes (settings.ASYNC_VIEW_CACHE_ALIAS)
+    dedup = False
+    # seconds the task_id is reused
+    # Keep shorter than ASYNC_VIEW_TEMP_FILE_DURATION_MS so the file still exists.
+    dedup_timeout = 60
+    # If False all users share the task and it is started with user_id=None
+    # (requires allow_no_user = True)
+    dedup_per_user = True
+
+    # Phase 2. task lease
+    # If set the task has a lease that is renewed for lease_timeout seconds by
+    # Phase 1. and every Phase 2. request. The task is cancelled cooperatively
+    # when the client stops polling (see django_celery_async_view.leases).
+    # Keep longer than the first poll interval of the client.
+    # Requires cache that is shared by web processes and workers
+    # (settings.ASYNC_VIEW_CACHE_ALIAS)
+    lease_timeout = None
+    # Phase 2. POST cancel=true (requires lease_timeout)
+    # Only the logged in user that started the task can cancel it.
+    # dedup tasks are shared so cancel only drops the interest of the caller:
+    # the task is cancelled when no client renews its lease.
+    # If True the running task is terminated (celery revoke terminate=True),
+    # else it stops at its next cancellation check.
+    cancel_terminate = False
+
     def has_permission(self, opened_result):
-        if opened_result['user_id'] is None:
+        if opened_result.user_id is None:
             # File has no owner
             if not self.allow_no_user:
                 raise Exception('user_id is None while allow_no_user=True')
             else:
                 return True
-        return opened_result['user_id'] == self.request.user.id
+        return opened_result.user_id == self.request.user.id
 
     def get_user_id(self, request):
         user_id = request.user.id
@@ -30,6 +106,219 @@ class _BaseView(View):
             raise Exception('user_id is None')
         return user_id
 
+    def start_task(self, user_id, *args, **kwargs):
+        """
+        Phase 1.
+        Starts the task or returns the identical task started earlier (dedup).
+        :param user_id:
+        :param args: task args
+        :param kwargs: task kwargs
+        :return: AsyncResult
+        """
+        if self.dedup:
+            result = self.start_dedup_task(user_id, args, kwargs)
+        else:
+            result = self.task.delay(user_id=user_id, *args, **kwargs)
+        if self.lease_timeout:
+            leases.renew_lease(result.id, self.lease_timeout)
+            if not self.dedup:
+                leases.set_task_owner(result.id, user_id, self.lease_timeout)
+        return result
+
+    def start_dedup_task(self, user_id, args, kwargs):
+        if not self.dedup_per_user:
+            user_id = None
+        kwargs['user_id'] = user_id
+        cache = get_cache()
+        key = self.get_dedup_key(args, kwargs)
+        # atomic: only one request adds the key and starts the task
+        for _ in range(2):
+            task_id = uuid()
+            if cache.add(key, task_id, self.dedup_timeout):
+                try:
+                    return self.task.apply_async(args=args, kwargs=kwargs, task_id=task_id)
+                except Exception:
+                    # not sent (e.g. broker down), identical requests must not attach to it
+                    cache.delete(key)
+                    raise
+            existing_task_id = cache.get(key)
+            if existing_task_id is None:
+                # expired in between
+                continue
+            result = self.task.AsyncResult(existing_task_id)
+            if not result.failed() and not leases.is_task_cancelled(existing_task_id):
+                return result
+            # failed or cancelled task is not reused
+            cache.delete(key)
+        return self.task.apply_async(args=args, kwargs=kwargs)
+
+    def get_dedup_key(self, args, kwargs):
+        """
+        :param args: task args
+        :param kwargs: task kwargs including user_id
+        :return: cache key of the task
+        """
+        return make_key('dedup', self.task.name, args, kwargs)
+
+    @staticmethod
+    def get_bool_param(request, name):
+        value = request.GET.get(name, '').strip().lower()
+        return value == 'true' or value == '1'
+
+    def is_cancel(self, request):
+        return self.get_bool_param(request, 'cancel')
+
+    def is_cancellable(self):
+        """
+        :return: True if the client may cancel the tasks of this view
+        """
+        return bool(self.lease_timeout)
+
+    def is_task_cancellable(self, request):
+        """
+        Phase 1.
+        Tasks without owner (no user) can not be cancelled.
+        Sets the CSRF cookie for the cancel POST.
+        :param request:
+        :return: True if the client may cancel the task it started
+        """
+        if not self.is_cancellable() or request.user.id is None:
+            return False
+        get_token(request)
+        return True
+
+    def post(self, request):
+        """
+        Phase 2. Cancel (JsonResponse)
+        Cancel changes the task so it is POST only:
+        POST ?task_id=<task_id>&cancel=true
+        :param request:
+        :return:
+        """
+        task_id = request.GET.get('task_id')
+        if task_id is None or not self.is_cancel(request):
+            return HttpResponseBadRequest()
+        return self.cancel_response(self.task.AsyncResult(task_id))
+
+    def cancel_response(self, result):
+        """
+        Phase 2. cancel=true
+        :param result: AsyncResult
+        :return:
+        """
+        if not self.is_cancellable():
+            return HttpResponseBadRequest('cancel requires lease_timeout')
+        if self.dedup:
+            # other clients may be attached, the lease expires
+            # when none of them polls
+            return JsonResponse({
+                'cancelled': False
+            })
+        if not self.has_cancel_permission(leases.get_task_owner(result.id)):
+            raise PermissionDenied
+        leases.cancel_task(result, terminate=self.cancel_terminate)
+        return JsonResponse({
+            'cancelled': True
+        })
+
+    def has_cancel_permission(self, owner):
+        """
+        :param owner: leases.get_task_owner()
+        :return:
+        """
+        if owner is None:
+            # not started by this view or expired
+            return False
+        if owner['user_id'] is None:
+            # anyone could cancel it
+            return False
+        return owner['user_id'] == self.request.user.id
+
+    def renew_lease(self, request, task_id):
+        """
+        Phase 2.
+        The lease lasts also while the request waits.
+        :param request:
+        :param task_id:
+        :return:
+        """
+        if not self.lease_timeout:
+            return
+        if self.is_event_stream(request):
+            wait = self.event_stream_timeout
+        elif self.is_long_poll(request):
+            wait = self.long_poll_timeout
+        else:
+            wait = 0
+        leases.renew_lease(task_id, self.lease_timeout, wait)
+
+    def get_status_data(self, result, ready):
+        """
+        Phase 2.
+        :param result: AsyncResult
+        :param ready: is the task ready
+        :return: {'ready': ready} and progress and eta if the task has reported them
+        """
+        data = {'ready': ready}
+        if not ready:
+            data.update(get_progress(result.id) or {})
+        return data
+
+    def is_long_poll(self, request):
+        return bool(self.long_poll_timeout) and self.get_bool_param(request, 'long_poll')
+
+    def wait_until_ready(self, result):
+        """
+        Phase 2. long polling
+        Blocks until the task is ready or long_poll_timeout has passed.
+        :param result: AsyncResult
+        :return: is the task ready
+        """
+        if result.ready():
+            return True
+        notification_backend = get_notification_backend()
+        if notification_backend is not None:
+            # published after the result is stored
+            return notification_backend.wait(
+                result.id, timeout=self.long_poll_timeout) is not None
+        deadline = time.time() + self.long_poll_timeout
+        interval = self.long_poll_interval
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+            if result.ready():
+                return True
+            interval = min(interval * self.long_poll_backoff, self.long_poll_max_interval)
+
+    def is_event_stream(self, request):
+        return self.get_bool_param(request, 'events')
+
+    def event_stream_response(self, result):
+        """
+        Phase 2. Server-Sent Events
+        :param result: AsyncResult
+        :return:
+        """
+        notification_backend = get_notification_backend()
+        if notification_backend is None:
+            return HttpResponseBadRequest('ASYNC_VIEW_NOTIFICATION_BACKEND is not set')
+        response = StreamingHttpResponse(
+            self.iter_task_events(result, notification_backend),
+            content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # nginx must not buffer the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def iter_task_events(self, result, notification_backend):
+        # reconnect after 1s if the stream is closed
+        yield 'retry: 1000\n\n'
+        if result.ready() or notification_backend.wait(
+                result.id, timeout=self.event_stream_timeout) is not None:
+            yield 'event: ready\ndata: {"ready": true}\n\n'
+
 
 class AbstractAsyncView(_BaseView):
     """
@@ -49,9 +338,23 @@ class AbstractAsyncView(_BaseView):
 
     eager = False
 
+    # View-level html cache (settings.ASYNC_VIEW_CACHE_ALIAS)
+    # If set the html is cached for cache_timeout seconds and
+    # cache hit returns the html directly in Phase 1. (no task, no polling)
+    cache_timeout = None
+    # What the cached html varies on
+    #   'user': per-user html, else the html is shared by all users
+    #       and the task is started with user_id=None (requires allow_no_user)
+    #   'GET': query parameters
+    #   callable(request): returns json serializable part of the key
+    cache_vary_on = ()
+    # Max number of cached html per view, the oldest are evicted
+    cache_max_entries = None
+
     def get(self, request):
         """
         Returns one of the following
+        # Phase 1. Cached html
         # Phase 1. Loading page
         # Phase 2. Not ready (JsonResponse)
         # Phase 3. Ready+Html (JsonResponse)
@@ -67,23 +370,56 @@ class AbstractAsyncView(_BaseView):
 
         if task_id is None:
             # Phase 1. Loading page
-            task_id = self.task.delay(
-                user_id=self.get_user_id(request)
-            )
-            return self.render_loading_page(request, task_id)
+            return self.no_task_id(request)
 
+        if self.is_cancel(request):
+            # Phase 2. Cancel is POST only
+            return HttpResponseNotAllowed(['POST'])
         result = self.task.AsyncResult(task_id)
+        self.renew_lease(request, task_id)
+        if self.is_event_stream(request):
+            # Phase 2. Server-Sent Events
+            return self.event_stream_response(result)
+        if self.is_long_poll(request):
+            self.wait_until_ready(result)
         # Ask: There's also no way to reliably check if a task exists in the queue
         # -> invalid task_id is not detected
         if not result.ready():
             # Phase 2. Not ready (JsonResponse)
-            return JsonResponse({
-                'ready': False
-            })
+            return self.not_ready_response(result)
         else:
             # Phase 3. Ready+Html (JsonResponse)
             result = result.get()
-            return self.create_html_response(result)
+            return self.create_task_html_response(result, task_id)
+
+    def no_task_id(self, request):
+        """
+        Phase 1.
+        Return cached html or start the task and render the loading page
+        :param request:
+        :return:
+        """
+        if self.cache_timeout:
+            cache_key = self.get_html_cache_key(request)
+            html_str = get_cache().get(cache_key)
+            if html_str is not None:
+                return HttpResponse(html_str)
+        user_id = self.get_user_id(request)
+        if self.is_html_shared():
+            user_id = None
+        task_result = self.start_task(user_id)
+        if self.cache_timeout:
+            # Phase 3. request (poll url) does not have the query of this request
+            self.set_task_html_cache_key(task_result.task_id, cache_key)
+        return self.render_loading_page(request, task_result.task_id)
+
+    def not_ready_response(self, result):
+        """
+        Phase 2. Not ready (JsonResponse)
+        :param result: AsyncResult
+        :return:
+        """
+        return JsonResponse(self.get_status_data(result, False))
 
     def eager_response(self, request):
         """
@@ -94,7 +430,8 @@ class AbstractAsyncView(_BaseView):
         # Phase 1.
         result = self.task(user_id=self.get_user_id(request))
         # Phase 3.
-        return self.create_html_response(result, json_response=False)
+        cache_key = self.get_html_cache_key(request) if self.cache_timeout else None
+        return self.create_html_response(result, json_response=False, cache_key=cache_key)
 
     def render_loading_page(self, request, task_id):
         """
@@ -109,27 +446,48 @@ class AbstractAsyncView(_BaseView):
             'view_title': 'Loading...',
             'task_id': task_id,
             'initial_interval': self.initial_interval,
-            'poll_interval': self.poll_interval
+            'poll_interval': self.poll_interval,
+            'cancellable': self.is_task_cancellable(request)
         }
         if self.context is not None:
             context.update(self.context)
 
         return render(request, self.loading_page_template, context)
 
-    def create_html_response(self, result, json_response=True):
+    def create_task_html_response(self, result, task_id):
+        """
+        # Phase 3. Ready+Html (JsonResponse)
+        Html is cached with the key of the Phase 1. request.
+        :param result:
+        :param task_id:
+        :return:
+        """
+        return self.create_html_response(
+            result, cache_key=self.get_task_html_cache_key(task_id))
+
+    def create_html_response(self, result, json_response=True, cache_key=None):
         """
         # Phase 3. Ready+Html (JsonResponse)
         :param result:
+        :param json_response:
+        :param cache_key: html cache key, None: not cached
         :return:
         """
-        opened_result = open_result(result)
+        opened_result = open_result_metadata(result)
         if opened_result is None:
             return HttpResponseBadRequest()
         if not self.has_permission(opened_result):
             raise PermissionDenied
-        html_str = opened_result['content']
+        load_result_content(opened_result)
+        html_str = opened_result.content
         if not html_str:
             return HttpResponseBadRequest()
+        if isinstance(html_str, six.binary_type):
+            # JsonResponse
+            html_str = html_str.decode('utf-8')
+        if cache_key is not None and self.cache_timeout and (
+                opened_result.user_id is None or not self.is_html_shared()):
+            self.cache_html(cache_key, html_str)
         if json_response:
             return JsonResponse({
                 'ready': True,
@@ -137,6 +495,70 @@ class AbstractAsyncView(_BaseView):
             })
         return HttpResponse(html_str)
 
+    def is_html_shared(self):
+        """
+        :return: True if cached html is shared by all users
+        """
+        return bool(self.cache_timeout) and 'user' not in self.cache_vary_on
+
+    def get_html_cache_key(self, request):
+        parts = []
+        for vary_on in self.cache_vary_on:
+            if vary_on == 'user':
+                parts.append(['user', request.user.id])
+            elif vary_on == 'GET':
+                parts.append(['GET', sorted(
+                    (name, request.GET.getlist(name)) for name in request.GET
+                    if name not in PROTOCOL_PARAMS)])
+            elif callable(vary_on):
+                parts.append(vary_on(request))
+            else:
+                raise ValueError('Unknown cache_vary_on {!r}'.format(vary_on))
+        return make_key('html', self.get_cache_namespace(), parts)
+
+    def get_cache_namespace(self):
+        return '{}.{}'.format(type(self).__module__, type(self).__name__)
+
+    def set_task_html_cache_key(self, task_id, key):
+        """
+        Phase 1.
+        :param task_id:
+        :param key: get_html_cache_key() of the Phase 1. request
+        :return:
+        """
+        get_cache().set(make_key('html-task', task_id), key, TASK_HTML_CACHE_KEY_TIMEOUT)
+
+    def get_task_html_cache_key(self, task_id):
+        """
+        Phase 3.
+        :param task_id:
+        :return: html cache key set in Phase 1. or None
+        """
+        if not self.cache_timeout:
+            return None
+        return get_cache().get(make_key('html-task', task_id))
+
+    def cache_html(self, key, html_str):
+        """
+        Phase 3.
+        :param key: get_html_cache_key() of the Phase 1. request
+        :param html_str:
+        :return:
+        """
+        cache = get_cache()
+        cache.set(key, html_str, self.cache_timeout)
+        if not self.cache_max_entries:
+            return
+        # Keys in the order they are cached, not atomic
+        # so the limit is approximate with concurrent requests.
+        index_key = make_key('html-index', self.get_cache_namespace())
+        keys = [k for k in cache.get(index_key, []) if k != key]
+        keys.append(key)
+        evicted_keys = keys[:-self.cache_max_entries]
+        if evicted_keys:
+            cache.delete_many(evicted_keys)
+        cache.set(index_key, keys[-self.cache_max_entries:], self.cache_timeout)
+
 
 class AsyncDownloadView(_BaseView):
     """
@@ -150,6 +572,12 @@ class AsyncDownloadView(_BaseView):
                 Set following (optional)
                     create_file_args
                     create_file_kwargs
+        Set (optional)
+            streaming = True
+                File is read and sent in chunks of stream_chunk_size.
+                Memory usage stays flat regardless of the file size.
+                TempFileFileSystemStorage files are sent with FileResponse
+                or by the web server (settings.ASYNC_VIEW_SENDFILE_HEADER).
     """
     create_file_args = None
     create_file_kwargs = None
@@ -157,6 +585,19 @@ class AsyncDownloadView(_BaseView):
 
     eager = False
 
+    streaming = False
+    stream_chunk_size = STREAM_CHUNK_SIZE
+
+    # Django >= 2.2 View calls setup() before dispatch() and
+    # expects it to set request, here setup() is the hook above
+    request = None
+
+    def dispatch(self, request, *args, **kwargs):
+        self.request = request
+        self.args = args
+        self.kwargs = kwargs
+        return super(AsyncDownloadView, self).dispatch(request, *args, **kwargs)
+
     def setup(self, request):
         """
         This should be implemented
@@ -182,16 +623,23 @@ class AsyncDownloadView(_BaseView):
                 'Task should be celery task extending AbstractAsyncDownloadTask.')
 
         task_id = request.GET.get('task_id')
-        download = request.GET.get('download', '').strip().lower()
-        download = download == 'true' or download == '1'
+        download = self.get_bool_param(request, 'download')
 
         if task_id is None:
             # Phase 1.
             return self.no_task_id(request)
 
+        if self.is_cancel(request):
+            # Phase 2. Cancel is POST only
+            return HttpResponseNotAllowed(['POST'])
         result = self.task.AsyncResult(task_id)
         if not download:
             # Phase 2.
+            self.renew_lease(request, task_id)
+            if self.is_event_stream(request):
+                return self.event_stream_response(result)
+            if self.is_long_poll(request):
+                self.wait_until_ready(result)
             return self.is_file_ready(result)
         else:
             # Phase 3.
@@ -227,15 +675,16 @@ class AsyncDownloadView(_BaseView):
         if isinstance(setup_return, HttpResponse):
             return setup_return
 
-        task_result = self.task.delay(
-            user_id=self.get_user_id(request),
+        task_result = self.start_task(
+            self.get_user_id(request),
             *(self.create_file_args or []),
             **(self.create_file_kwargs or {})
         )
         task_id = task_result.task_id
         return JsonResponse({
             'task_id': task_id,
-            'ready': task_result.ready()
+            'ready': task_result.ready(),
+            'cancellable': self.is_task_cancellable(request)
         })
 
     def is_file_ready(self, result):
@@ -244,9 +693,7 @@ class AsyncDownloadView(_BaseView):
         Is file ready
         Returns:
         """
-        return JsonResponse({
-            'ready': result.ready()
-        })
+        return JsonResponse(self.get_status_data(result, result.ready()))
 
     def get_file_response(self, result):
         """
@@ -255,17 +702,145 @@ class AsyncDownloadView(_BaseView):
         Returns:
 
         """
-        opened_result = open_result(result)
+        opened_result = open_result_metadata(result)
         if opened_result is None:
             return HttpResponseBadRequest()
         if not self.has_permission(opened_result):
             raise PermissionDenied
+        stored_content_encoding = opened_result.content_encoding
+        decompress = not self.accepts_content_encoding(stored_content_encoding)
+        # ETag and ranges are of the stored content
+        send_as_stored = not (stored_content_encoding and decompress)
+        if send_as_stored and opened_result.content_hash:
+            etag = quote_etag(opened_result.content_hash)
+        else:
+            etag = None
+        last_modified = opened_result.last_modified
+
+        byte_range = None
+        if is_not_modified(self.request, etag, last_modified):
+            response = HttpResponseNotModified()
+        else:
+            if send_as_stored and opened_result.size is not None:
+                byte_range = parse_range_header(
+                    self.request, opened_result.size, etag, last_modified)
+            if byte_range == RANGE_NOT_SATISFIABLE:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = 'bytes */{}'.format(opened_result.size)
+                return response
+            if not (opened_result.file_path and send_as_stored and byte_range is None):
+                # file system files are sent from the file as they are
+                load_result_content(
+                    opened_result, stream=self.streaming, chunk_size=self.stream_chunk_size,
+                    decompress=decompress, byte_range=byte_range)
+            response = self.file_instance_to_file_response(opened_result)
+
+        if opened_result.content_encoding:
+            # compressed content is sent as is
+            response['Content-Encoding'] = opened_result.content_encoding
+        if stored_content_encoding:
+            patch_vary_headers(response, ('Accept-Encoding',))
+        if etag is not None:
+            response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(timestamp(last_modified))
+        if send_as_stored and opened_result.size is not None:
+            response['Accept-Ranges'] = 'bytes'
+        if byte_range is not None:
+            # 206 Partial Content
+            start, stop = byte_range
+            response.status_code = 206
+            response['Content-Range'] = 'bytes {}-{}/{}'.format(
+                start, stop - 1, opened_result.size)
+            response['Content-Length'] = stop - start
+        return response
 
-        return self.file_instance_to_file_response(opened_result)
+    def accepts_content_encoding(self, content_encoding):
+        """
+        :param content_encoding: e.g. 'gzip'
+        :return: True if the client accepts content_encoding
+        """
+        if not content_encoding:
+            return False
+        return accepts_encoding(
+            self.request.META.get('HTTP_ACCEPT_ENCODING', ''), content_encoding)
 
     def file_instance_to_file_response(self, opened_result):
-        response = HttpResponse(content_type=opened_result['mimetype'])
+        if opened_result.file_path:
+            response = self.file_path_to_file_response(opened_result)
+        elif self.streaming:
+            # content is generator of decoded chunks
+            response = StreamingHttpResponse(
+                opened_result.content,
+                content_type=opened_result.mimetype)
+        else:
+            response = HttpResponse(content_type=opened_result.mimetype)
+            response.write(opened_result.content)
         response['Content-Disposition'] = u'attachment; filename={}'.format(
-            opened_result['filename'])
-        response.write(opened_result['content'])
+            opened_result.filename)
         return response
+
+    def file_path_to_file_response(self, opened_result):
+        """
+        Sends TempFileFileSystemStorage file.
+        If settings.ASYNC_VIEW_SENDFILE_HEADER is set the web server sends the file
+            'X-Accel-Redirect' (nginx)
+                Header value is ASYNC_VIEW_SENDFILE_URL_PREFIX + <file path>
+                e.g. ASYNC_VIEW_SENDFILE_URL_PREFIX = '/protected-temp-files/'
+                and nginx location /protected-temp-files/ is internal alias
+                to ASYNC_VIEW_TEMP_FILE_ROOT
+            'X-Sendfile' (apache mod_xsendfile, lighttpd)
+                Header value is the absolute file path
+        else file is sent with FileResponse (wsgi.file_wrapper, sendfile if available)
+        :param opened_result:
+        :return:
+        """
+        file_path = opened_result.file_path
+        sendfile_header = getattr(settings, 'ASYNC_VIEW_SENDFILE_HEADER', None)
+        if sendfile_header is None:
+            return FileResponse(
+                open(file_path, 'rb'), content_type=opened_result.mimetype)
+        response = HttpResponse(content_type=opened_result.mimetype)
+        if sendfile_header == 'X-Accel-Redirect':
+            url_prefix = getattr(settings, 'ASYNC_VIEW_SENDFILE_URL_PREFIX', '/')
+            relative_path = os.path.relpath(file_path, get_temp_file_root())
+            response[sendfile_header] = '{}/{}'.format(
+                url_prefix.rstrip('/'), relative_path.replace(os.sep, '/'))
+        else:
+            response[sendfile_header] = file_path
+        return response
+
+
+class BatchStatusView(View):
+    """
+    Phase 2. of many tasks with one request and one result backend query.
+    GET ?task_ids=<task_id>,<task_id>
+    returns {"tasks": {"<task_id>": {"ready": <is the task ready>}}}
+    pending tasks have also progress and eta if they have reported them
+    Used by AsyncViews.batch_status_url (django_celery_async_view.urls)
+    Renews the leases of the pending tasks (_BaseView.lease_timeout).
+    """
+    max_task_ids = 100
+
+    # defaults to the current celery app
+    celery_app = None
+
+    def get(self, request):
+        task_ids = [
+            task_id for task_id in request.GET.get('task_ids', '').split(',') if task_id]
+        if not task_ids or len(task_ids) > self.max_task_ids:
+            return HttpResponseBadRequest()
+        backend = (self.celery_app or current_app).backend
+        task_states = get_task_states(task_ids, backend)
+        pending_task_ids = [
+            task_id for task_id, state in task_states.items()
+            if state not in states.READY_STATES]
+        leases.renew_existing_leases(pending_task_ids)
+        tasks = dict(
+            (task_id, {'ready': state in states.READY_STATES})
+            for task_id, state in task_states.items())
+        for task_id, progress in get_many_progress(pending_task_ids).items():
+            tasks[task_id].update(progress)
+        return JsonResponse({
+            'tasks': tasks
+        })
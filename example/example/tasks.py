@@ -87,8 +87,5 @@ class ExampleDownloadCreateFile(AbstractAsyncDownloadCreateFile):
 
     @staticmethod
     def create_example_file_string(how_many_rows):
-        file_content = ''
         row = 'This file just contains this same line {} times.\n'.format(how_many_rows)
-        for i in range(how_many_rows):
-            file_content += row
-        return file_content
+        return row * how_many_rows
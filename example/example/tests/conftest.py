@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+import sys
+
+# async def tests
+collect_ignore = ['test_asgi_views.py'] if sys.version_info[0] < 3 else []
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import re
+from unittest import skipIf
+
+import django
+from asgiref.sync import sync_to_async
+from django.template.loader import render_to_string
+from django.test import override_settings
+from mock import patch
+
+from example.tasks import ExampleDownloadCreateFile
+from example.tests.test_utils import CeleryTestCase
+from example.views import ExampleDownloadView, ExampleView
+
+from http.client import FORBIDDEN
+
+from django_celery_async_view.leases import is_task_cancelled
+
+# async class-based views and StreamingHttpResponse with async iterators
+ASGI_VIEWS_UNSUPPORTED = django.VERSION < (4, 2)
+
+if not ASGI_VIEWS_UNSUPPORTED:
+    from django.urls import re_path
+    from django_celery_async_view.asgi_views import AsgiAbstractAsyncView, \
+        AsgiAsyncDownloadView
+
+    class ExampleAsgiView(AsgiAbstractAsyncView, ExampleView):
+        pass
+
+    class ExampleAsgiDownloadView(AsgiAsyncDownloadView, ExampleDownloadView):
+        pass
+
+    urlpatterns = [
+        re_path(r'^$',
+                ExampleAsgiView.as_view(),
+                name='example_view'),
+        re_path(r'^example-download/$',
+                ExampleAsgiDownloadView.as_view(),
+                name='example_download'),
+    ]
+
+
+@skipIf(ASGI_VIEWS_UNSUPPORTED, 'Requires Django >= 4.2')
+@override_settings(ROOT_URLCONF='example.tests.test_asgi_views')
+class BaseTestAsgiViews(CeleryTestCase):
+    task_id_pattern = re.compile(r"var\stask_id\s=\s'([-|\w]+)';")
+    example_view_url = '/'
+    example_download_url = '/example-download/'
+
+    async def view_phase1(self):
+        response = await self.async_client.get(self.example_view_url)
+        self.assertEqual(response.status_code, 200)
+        task_ids = self.task_id_pattern.findall(response.content.decode('utf-8'))
+        self.assertEqual(1, len(task_ids))
+        return task_ids[0]
+
+    async def download_phase1(self):
+        response = await self.async_client.get(self.example_download_url)
+        self.assertEqual(response.status_code, 200)
+        content = self.assertIsJSON(response.content)
+        self.assertFalse(content['ready'])
+        return content['task_id']
+
+    async def login(self, username, password):
+        # the session is stored in the database
+        login_success = await sync_to_async(self.async_client.login)(
+            username=username, password=password)
+        self.assertTrue(login_success)
+
+    async def get_response_content(self, response):
+        if not response.streaming:
+            return response.content
+        return b''.join([chunk async for chunk in response.streaming_content])
+
+    def assert_async_view_html(self, html):
+        self.assertEqual(
+            html,
+            render_to_string(
+                template_name='django_celery_async_view/after_loading.html',
+                context={
+                    'title': 'Just an Example'
+                }, )
+        )
+
+
+class TestAsgiViews(BaseTestAsgiViews):
+    """
+    Phase 1. 2. and 3. through the async views
+    """
+    async def test_get_async_view(self):
+        task_id = await self.view_phase1()
+        # Phase 2. waits and Phase 3. returns the html
+        response = await self.async_client.get(
+            self.example_view_url, {
+                'task_id': task_id,
+                'long_poll': 'true',
+            })
+        self.assertEqual(response.status_code, 200)
+        content = self.assertIsJSON(response.content)
+        self.assertTrue(content['ready'])
+        self.assert_async_view_html(content['html'])
+
+    async def test_get_async_download(self):
+        task_id = await self.download_phase1()
+        # Phase 2.
+        response = await self.async_client.get(
+            self.example_download_url, {
+                'task_id': task_id,
+                'long_poll': 'true',
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.assertIsJSON(response.content)['ready'])
+        # Phase 3.
+        response = await self.async_client.get(
+            self.example_download_url, {
+                'task_id': task_id,
+                'download': 'true',
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename={}'.format(ExampleDownloadCreateFile.EXAMPLE_FILE_NAME))
+        self.assertEqual(
+            (await self.get_response_content(response)).decode('utf-8'),
+            ExampleDownloadCreateFile.create_example_file_string(
+                ExampleDownloadView.HOW_MANY_ROWS))
+
+
+@patch('example.views.ExampleDownloadView.streaming', True)
+class TestAsgiViews_STREAMING(TestAsgiViews):
+    """
+    Streamed content is read in sync_to_async
+    """
+    pass
+
+
+@patch('example.views.ExampleDownloadView.lease_timeout', 30)
+class TestAsgiViews_CANCEL(BaseTestAsgiViews):
+
+    async def test_cancel(self):
+        await self.login(self.username1, self.password1)
+        task_id = await self.download_phase1()
+        response = await self.async_client.post(
+            '{}?task_id={}&cancel=true'.format(self.example_download_url, task_id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.assertIsJSON(response.content), {'cancelled': True})
+        self.assertTrue(is_task_cancelled(task_id))
+
+    async def test_cancel_other_user(self):
+        await self.login(self.username1, self.password1)
+        task_id = await self.download_phase1()
+        await self.login(self.username2, self.password2)
+        response = await self.async_client.post(
+            '{}?task_id={}&cancel=true'.format(self.example_download_url, task_id))
+        self.assertEqual(response.status_code, FORBIDDEN)
+        self.assertFalse(is_task_cancelled(task_id))
+
+    async def test_cancel_get(self):
+        await self.login(self.username1, self.password1)
+        task_id = await self.download_phase1()
+        response = await self.async_client.get(
+            self.example_download_url, {'task_id': task_id, 'cancel': 'true'})
+        self.assertEqual(response.status_code, 405)
+        self.assertFalse(is_task_cancelled(task_id))
+
+
+@override_settings(
+    ASYNC_VIEW_NOTIFICATION_BACKEND='django_celery_async_view.notifications.LocalNotificationBackend')
+class TestAsgiViews_NOTIFICATION(BaseTestAsgiViews):
+    """
+    Phase 2. waits for the completion event
+    Worker runs in the same process so LocalNotificationBackend can be used
+    """
+    async def test_long_poll(self):
+        task_id = await self.download_phase1()
+        response = await self.async_client.get(
+            self.example_download_url, {
+                'task_id': task_id,
+                'long_poll': 'true',
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.assertIsJSON(response.content)['ready'])
+
+    async def test_events(self):
+        task_id = await self.view_phase1()
+        response = await self.async_client.get(
+            self.example_view_url, {
+                'task_id': task_id,
+                'events': 'true',
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = (await self.get_response_content(response)).decode('utf-8')
+        self.assertIn('event: ready', events)
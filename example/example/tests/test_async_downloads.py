@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, unicode_literals
+import gzip
+import io
+import tempfile
+
 from mock import patch
 
 try:
@@ -8,8 +12,17 @@ try:
 except ImportError:
     # Deprecated and removed RemovedInDjango20Warning
     from django.core.urlresolvers import reverse
+from django_celery_async_view.cache import get_cache
+from django_celery_async_view.exports import AbstractCSVExport
+from django_celery_async_view.leases import TaskCancelled, is_task_cancelled, renew_lease
 from django_celery_async_view.models import TempFile
-from django.test import override_settings
+from django_celery_async_view.storage import TempFileFileSystemStorage
+from django_celery_async_view.task_helpers import AbstractAsyncDownloadCreateFile, \
+    get_storage, get_temp_file_content, reset_storages
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import Client, override_settings
 
 from example.tasks import ExampleDownloadCreateFile, example_download_task
 from example.tests.test_utils import CeleryTestCase
@@ -103,13 +116,19 @@ class BaseTestAsyncDownload(CeleryTestCase):
             expected_file_content = \
                 ExampleDownloadCreateFile.create_example_file_string(
                     ExampleDownloadView.HOW_MANY_ROWS)
-            self.assertEquals(response.content, expected_file_content)
+            self.assertEquals(self.get_response_content(response), expected_file_content)
         else:
             # FAIL
             self.assertEqual(response.status_code, FORBIDDEN)
             #  django.views.defaults.permission_denied
             self.assertEquals(response.content, '<h1>403 Forbidden</h1>')
 
+    @staticmethod
+    def get_response_content(response):
+        if response.streaming:
+            return b''.join(response.streaming_content)
+        return response.content
+
     @property
     def example_download_url(self):
         return reverse('example_download')
@@ -157,7 +176,8 @@ class TestAsyncDownload(BaseTestAsyncDownload):
         self.phase3_get_file(task_id, success=True)
 
 
-@override_settings(ASYNC_VIEW_TEMP_FILE_DURATION_MS=0)
+@override_settings(ASYNC_VIEW_TEMP_FILE_DURATION_MS=0,
+                   ASYNC_VIEW_DELETE_OLD_FILES_IN_TASK=True)
 class TestAsyncDownload_TEMP_FILE_DURATION_MS0(BaseTestAsyncDownload):
 
     def test_delete_file_after(self):
@@ -180,11 +200,505 @@ class TestAsyncDownload_TEMP_FILE_DURATION_MS0(BaseTestAsyncDownload):
             original_tempfile_count, 0, '(all deleted from the original state) ')
 
 
+@override_settings(ASYNC_VIEW_TEMP_FILE_DURATION_MS=0)
+class TestDeleteOldTempFiles(BaseTestAsyncDownload):
+
+    def test_delete_old_temp_files_command(self):
+        """
+        Tasks do not delete old files by default.
+        delete_old_temp_files command deletes them in batches.
+        """
+        original_tempfile_count = TempFile.objects.count()
+        original_tempfile_ids = set(TempFile.objects.values_list('id', flat=True))
+        self._test_get_async_download()
+        self._test_get_async_download()
+        self.assert_tempfile_count_change(
+            original_tempfile_count, 2, '(nothing deleted by the tasks) ')
+        created_tempfile_ids = set(
+            TempFile.objects.values_list('id', flat=True)) - original_tempfile_ids
+        self.assertEqual(len(created_tempfile_ids), 2)
+        call_command('delete_old_temp_files', batch_size=1)
+        self.assertFalse(TempFile.objects.filter(id__in=created_tempfile_ids).exists())
+
+
 @override_settings(ASYNC_VIEW_AND_DOWNLOAD_USE_DB=False)
 class TestAsyncDownload_NoDB(CeleryTestCaseNoDBMixin, TestAsyncDownload):
     pass
 
 
+@override_settings(ASYNC_VIEW_AND_DOWNLOAD_USE_DB=False)
+@patch('example.tasks.ExampleDownloadCreateFile.payload_codec', 'temp_file')
+class TestAsyncDownload_NoDB_TEMP_FILE_CODEC(TestAsyncDownload):
+    """
+    Content is stored in TempFile and the result has only a reference
+    """
+    pass
+
+
+@override_settings(ASYNC_VIEW_AND_DOWNLOAD_USE_DB=False,
+                   ASYNC_VIEW_RESULT_INLINE_MAX_SIZE=10)
+class TestAsyncDownload_NoDB_INLINE_MAX_SIZE(TestAsyncDownload):
+    """
+    Content is larger than ASYNC_VIEW_RESULT_INLINE_MAX_SIZE
+    so it is stored in TempFile and the result is the TempFile id
+    """
+    pass
+
+
+@patch('example.views.ExampleDownloadView.streaming', True)
+@patch('example.views.ExampleDownloadView.stream_chunk_size', 3)
+class TestAsyncDownload_STREAMING(TestAsyncDownload):
+    """
+    The file is read and sent in chunks
+    """
+    pass
+
+
+@override_settings(ASYNC_VIEW_AND_DOWNLOAD_USE_DB=False)
+class TestAsyncDownload_STREAMING_NoDB(CeleryTestCaseNoDBMixin, TestAsyncDownload_STREAMING):
+    pass
+
+
+@override_settings(ASYNC_VIEW_TEMP_FILE_STORAGE_FORMAT='binary')
+class TestAsyncDownload_BINARY(TestAsyncDownload):
+    """
+    TempFile content is stored as raw bytes
+    """
+    pass
+
+
+@override_settings(ASYNC_VIEW_TEMP_FILE_STORAGE_FORMAT='binary')
+class TestAsyncDownload_BINARY_STREAMING(TestAsyncDownload_STREAMING):
+    pass
+
+
+@override_settings(ASYNC_VIEW_TEMP_FILE_STORAGE_FORMAT='chunked',
+                   ASYNC_VIEW_TEMP_FILE_CHUNK_SIZE=16)
+class TestAsyncDownload_CHUNKED_STREAMING(TestAsyncDownload_STREAMING):
+    """
+    TempFile content is stored in TempFileChunk rows
+    """
+    pass
+
+
+@override_settings(
+    ASYNC_VIEW_STORAGE_BACKEND='django_celery_async_view.storage.TempFileFileSystemStorage',
+    ASYNC_VIEW_TEMP_FILE_ROOT=tempfile.mkdtemp())
+class TestAsyncDownload_FILESYSTEM_STREAMING(TestAsyncDownload_STREAMING):
+    """
+    TempFile content is stored in ASYNC_VIEW_TEMP_FILE_ROOT and sent with FileResponse
+    """
+    pass
+
+
+@override_settings(
+    ASYNC_VIEW_STORAGE_BACKEND='django_celery_async_view.storage.TempFileFileSystemStorage',
+    ASYNC_VIEW_TEMP_FILE_ROOT=tempfile.mkdtemp(),
+    ASYNC_VIEW_SENDFILE_HEADER='X-Accel-Redirect',
+    ASYNC_VIEW_SENDFILE_URL_PREFIX='/protected/')
+class TestAsyncDownload_FILESYSTEM_SENDFILE(BaseTestAsyncDownload):
+    """
+    TempFile in ASYNC_VIEW_TEMP_FILE_ROOT is sent by the web server
+    also when the view does not stream
+    """
+    def test_x_accel_redirect(self):
+        task_id = self.phase1_start_creating_file()
+        example_download_task.AsyncResult(task_id).wait(timeout=5, interval=0.5)
+        response = self.client.get(
+            self.example_download_url, {
+                'task_id': task_id,
+                'download': True,
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['X-Accel-Redirect'].startswith('/protected/'))
+        self.assertEqual(response.content, b'')
+
+
+@patch('example.tasks.ExampleDownloadCreateFile.compression', 'gzip')
+class TestAsyncDownload_GZIP(TestAsyncDownload):
+    """
+    TempFile content is stored compressed.
+    Clients without Accept-Encoding: gzip get it decompressed.
+    """
+    def test_content_encoding(self):
+        task_id = self.phase1_start_creating_file()
+        example_download_task.AsyncResult(task_id).wait(timeout=5, interval=0.5)
+        response = self.client.get(
+            self.example_download_url, {
+                'task_id': task_id,
+                'download': True,
+            },
+            HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        content = gzip.GzipFile(
+            fileobj=io.BytesIO(self.get_response_content(response))).read()
+        self.assertEqual(
+            content.decode('utf-8'),
+            ExampleDownloadCreateFile.create_example_file_string(
+                ExampleDownloadView.HOW_MANY_ROWS))
+
+
+@override_settings(ASYNC_VIEW_AND_DOWNLOAD_USE_DB=False)
+class TestAsyncDownload_GZIP_NoDB(CeleryTestCaseNoDBMixin, TestAsyncDownload_GZIP):
+    pass
+
+
+class TestAsyncDownload_CONDITIONAL(BaseTestAsyncDownload):
+    """
+    Phase 3. ETag, Last-Modified and Range
+    """
+    def test_not_modified_and_range(self):
+        task_id = self.phase1_start_creating_file()
+        example_download_task.AsyncResult(task_id).wait(timeout=5, interval=0.5)
+        params = {
+            'task_id': task_id,
+            'download': True,
+        }
+        response = self.client.get(self.example_download_url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('Last-Modified', response)
+        etag = response['ETag']
+        expected_file_content = ExampleDownloadCreateFile.create_example_file_string(
+            ExampleDownloadView.HOW_MANY_ROWS)
+
+        response = self.client.get(
+            self.example_download_url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(
+            self.example_download_url, params, HTTP_RANGE='bytes=5-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(
+            response['Content-Range'],
+            'bytes 5-9/{}'.format(len(expected_file_content)))
+        self.assertEqual(
+            self.get_response_content(response).decode('utf-8'),
+            expected_file_content[5:10])
+
+        response = self.client.get(
+            self.example_download_url, params, HTTP_RANGE='bytes=100000-')
+        self.assertEqual(response.status_code, 416)
+
+
+@patch('example.views.ExampleDownloadView.streaming', True)
+class TestAsyncDownload_CONDITIONAL_STREAMING(TestAsyncDownload_CONDITIONAL):
+    pass
+
+
+class TestAsyncDownload_LONG_POLL(BaseTestAsyncDownload):
+    """
+    Phase 2. waits until the file is ready
+    """
+    def test_long_poll(self):
+        task_id = self.phase1_start_creating_file()
+        # no waiting in the test, the view does it
+        response = self.client.get(
+            self.example_download_url, {
+                'task_id': task_id,
+                'long_poll': 'true',
+            })
+        self.assertEqual(response.status_code, 200)
+        content = self.assertIsJSON(response.content)
+        self.assertTrue(content['ready'])
+        self.phase3_get_file(task_id)
+
+
+@override_settings(
+    ASYNC_VIEW_NOTIFICATION_BACKEND='django_celery_async_view.notifications.LocalNotificationBackend')
+class TestAsyncDownload_LONG_POLL_NOTIFICATION(TestAsyncDownload_LONG_POLL):
+    """
+    Phase 2. waits for the completion event instead of polling the result backend
+    """
+    pass
+
+
+@patch('example.views.ExampleDownloadView.dedup', True)
+class TestAsyncDownload_DEDUP(BaseTestAsyncDownload):
+    """
+    Identical Phase 1. requests attach to the same task
+    """
+    def setUp(self):
+        super(TestAsyncDownload_DEDUP, self).setUp()
+        # the task of the previous test is not attached to
+        get_cache().clear()
+
+    def test_dedup(self):
+        task_id = self.phase1_start_creating_file()
+        response = self.client.get(self.example_download_url)
+        self.assertEqual(response.status_code, 200)
+        content = self.assertIsJSON(response.content)
+        self.assertEqual(content['task_id'], task_id)
+        example_download_task.AsyncResult(task_id).wait(timeout=5, interval=0.5)
+        self.phase3_get_file(task_id)
+
+    def test_dedup_publish_failed(self):
+        with patch.object(example_download_task, 'apply_async', side_effect=IOError):
+            with self.assertRaises(IOError):
+                self.client.get(self.example_download_url)
+        # not attached to the task that was never sent
+        task_id = self.phase1_start_creating_file()
+        example_download_task.AsyncResult(task_id).wait(timeout=5, interval=0.5)
+        self.phase3_get_file(task_id)
+
+
+@patch('example.views.ExampleDownloadView.lease_timeout', 30)
+class TestAsyncDownload_CANCEL(BaseTestAsyncDownload):
+    """
+    Leases are renewed by polling, POST cancel=true cancels the task
+    """
+    def setUp(self):
+        super(TestAsyncDownload_CANCEL, self).setUp()
+        # dedup tasks of the other tests are not attached to
+        get_cache().clear()
+
+    def post_cancel(self, task_id, client=None, **extra):
+        return (client or self.client).post(
+            '{}?task_id={}&cancel=true'.format(self.example_download_url, task_id), **extra)
+
+    def test_lease(self):
+        task_id = self.phase1_start_creating_file()
+        self.assertFalse(is_task_cancelled(task_id))
+        response = self.client.get(self.example_download_url, {'task_id': task_id})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(is_task_cancelled(task_id))
+
+    def test_cancel(self):
+        self.assertTrue(self.client.login(username=self.username1, password=self.password1))
+        task_id = self.phase1_start_creating_file()
+        response = self.post_cancel(task_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.assertIsJSON(response.content), {'cancelled': True})
+        self.assertTrue(is_task_cancelled(task_id))
+
+    def test_cancel_get(self):
+        self.assertTrue(self.client.login(username=self.username1, password=self.password1))
+        task_id = self.phase1_start_creating_file()
+        response = self.client.get(
+            self.example_download_url, {'task_id': task_id, 'cancel': 'true'})
+        self.assertEqual(response.status_code, 405)
+        self.assertFalse(is_task_cancelled(task_id))
+
+    def test_cancel_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        self.assertTrue(client.login(username=self.username1, password=self.password1))
+        response = client.get(self.example_download_url)
+        content = self.assertIsJSON(response.content)
+        self.assertTrue(content['cancellable'])
+        task_id = content['task_id']
+        self.assertEqual(self.post_cancel(task_id, client).status_code, FORBIDDEN)
+        self.assertFalse(is_task_cancelled(task_id))
+        # Phase 1. set the CSRF cookie
+        response = self.post_cancel(
+            task_id, client, HTTP_X_CSRFTOKEN=client.cookies[settings.CSRF_COOKIE_NAME].value)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(is_task_cancelled(task_id))
+
+    def test_cancel_no_user(self):
+        response = self.client.get(self.example_download_url)
+        content = self.assertIsJSON(response.content)
+        self.assertFalse(content['cancellable'])
+        # anyone could cancel the task of an anonymous user
+        response = self.post_cancel(content['task_id'])
+        self.assertEqual(response.status_code, FORBIDDEN)
+        self.assertFalse(is_task_cancelled(content['task_id']))
+
+    def test_cancel_other_user(self):
+        self.assertTrue(self.client.login(username=self.username1, password=self.password1))
+        task_id = self.phase1_start_creating_file()
+        self.assertTrue(self.client.login(username=self.username2, password=self.password2))
+        response = self.post_cancel(task_id)
+        self.assertEqual(response.status_code, FORBIDDEN)
+        self.assertFalse(is_task_cancelled(task_id))
+
+    def test_cancel_dedup(self):
+        with patch('example.views.ExampleDownloadView.dedup', True):
+            task_id = self.phase1_start_creating_file()
+            response = self.post_cancel(task_id)
+        # shared task is cancelled only when its lease expires
+        self.assertEqual(self.assertIsJSON(response.content), {'cancelled': False})
+        self.assertFalse(is_task_cancelled(task_id))
+
+    def test_cancel_without_lease(self):
+        with patch('example.views.ExampleDownloadView.lease_timeout', None):
+            task_id = self.phase1_start_creating_file()
+            response = self.post_cancel(task_id)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(is_task_cancelled(task_id))
+
+    def test_expired_lease(self):
+        renew_lease('expired-task-id', -1)
+        create_file = ExampleDownloadCreateFile()
+        with patch.object(create_file, 'get_task_id', return_value='expired-task-id'):
+            with self.assertRaises(TaskCancelled):
+                create_file.run(user_id=None, how_many_rows=10)
+
+
+class TestAsyncDownload_PROGRESS(BaseTestAsyncDownload):
+    """
+    Progress reported by create_file is in Phase 2. response
+    """
+    def test_progress(self):
+        create_file = ExampleDownloadCreateFile()
+        with patch.object(create_file, 'get_task_id', return_value='progress-task-id'):
+            create_file.report_progress(current=10, total=40, stage='rows')
+            # rate limited
+            create_file.report_progress(current=20, total=40, stage='rows')
+        response = self.client.get(
+            self.example_download_url, {'task_id': 'progress-task-id'})
+        content = self.assertIsJSON(response.content)
+        self.assertFalse(content['ready'])
+        self.assertEqual(content['progress'], {
+            'percent': 25.0, 'current': 10, 'total': 40, 'stage': 'rows'})
+        self.assertIsNone(content['eta'])
+
+
+class GeneratorCreateFile(ExampleDownloadCreateFile):
+
+    def create_file(self, how_many_rows):
+        def rows():
+            for _ in range(how_many_rows):
+                yield 'This file just contains this same line {} times.\n'.format(
+                    how_many_rows)
+        return rows(), self.EXAMPLE_FILE_NAME, self.EXAMPLE_FILE_MIMETYPE
+
+
+class TestAsyncDownload_GENERATOR(BaseTestAsyncDownload):
+    """
+    create_file returns a generator, it is written chunk by chunk
+    """
+    def _test_generator(self, storage_format):
+        create_file = GeneratorCreateFile()
+        create_file.storage_format = storage_format
+        temp_file = TempFile.objects.get(id=create_file.run(user_id=None, how_many_rows=100))
+        self.assertEqual(temp_file.storage_format, storage_format)
+        self.assertEqual(
+            get_temp_file_content(temp_file),
+            ExampleDownloadCreateFile.create_example_file_string(100).encode('utf-8'))
+
+    def test_base64(self):
+        self._test_generator('base64')
+
+    def test_chunked(self):
+        self._test_generator('chunked')
+
+
+def square_chunk(number):
+    return '{}\n'.format(number * number)
+
+
+class MapChunksCreateFile(AbstractAsyncDownloadCreateFile):
+    storage_format = 'chunked'
+    map_chunks_max_workers = 3
+
+    def create_file(self, how_many):
+        return self.map_chunks(square_chunk, range(how_many), prefetch=2), 'squares.txt', 'text/plain'
+
+
+class TestAsyncDownload_MAP_CHUNKS(BaseTestAsyncDownload):
+    """
+    create_file() content computed in a thread pool is written in order
+    """
+    def test_map_chunks(self):
+        temp_file = TempFile.objects.get(id=MapChunksCreateFile().run(None, 100))
+        self.assertEqual(
+            get_temp_file_content(temp_file),
+            ''.join(square_chunk(number) for number in range(100)).encode('utf-8'))
+
+
+class UserCSVExport(AbstractCSVExport):
+    fields = ('username',)
+
+    def get_queryset(self, *usernames):
+        return User.objects.filter(username__in=usernames).order_by('username')
+
+
+class UserPartitionedCSVExport(UserCSVExport):
+    partition_count = 2
+
+    def get_queryset(self, *usernames):
+        return User.objects.filter(username__in=usernames).order_by('pk')
+
+
+class TestQuerySetExport(BaseTestAsyncDownload):
+    """
+    Queryset rows are exported as csv chunk by chunk
+    """
+    def test_csv(self):
+        temp_file = TempFile.objects.get(
+            id=UserCSVExport().run(None, self.username1, self.username2))
+        self.assertEqual(temp_file.storage_format, 'chunked')
+        self.assertEqual(temp_file.mimetype, 'text/csv')
+        self.assertEqual(
+            get_temp_file_content(temp_file),
+            'username\r\n{}\r\n{}\r\n'.format(
+                self.username1, self.username2).encode('utf-8'))
+
+    def test_csv_partitions(self):
+        # last in the pk order, first in the username order
+        User.objects.create_user(username='user0', password='user0')
+        usernames = ('user0', self.username1, self.username2)
+        export = UserPartitionedCSVExport()
+        self.assertEqual(len(export.get_partitions(*usernames)), 2)
+        # not in a worker: partitions are created one after another
+        content = get_temp_file_content(TempFile.objects.get(
+            id=export.run(None, *usernames)))
+        self.assertEqual(
+            content.splitlines(),
+            [b'username', self.username1.encode('utf-8'), self.username2.encode('utf-8'), b'user0'])
+
+    def test_csv_partitions_ordering(self):
+        export = UserCSVExport()
+        export.partition_count = 2
+        with self.assertRaises(ValueError):
+            export.get_partitions(self.username1, self.username2)
+
+
+class TestStorageRegistry(BaseTestAsyncDownload):
+    """
+    Storages are cached per process and reset when the storage settings change
+    """
+    def test_cached(self):
+        self.assertIs(get_storage(), get_storage())
+        self.assertIsNot(get_storage(), get_storage('chunked'))
+        storage = get_storage()
+        reset_storages()
+        self.assertIsNot(get_storage(), storage)
+
+    def test_setting_changed(self):
+        storage = get_storage()
+        with override_settings(
+                ASYNC_VIEW_STORAGE_BACKEND='django_celery_async_view.storage.TempFileFileSystemStorage',
+                ASYNC_VIEW_TEMP_FILE_ROOT=tempfile.gettempdir()):
+            self.assertIsInstance(get_storage(), TempFileFileSystemStorage)
+        self.assertIsNot(get_storage(), storage)
+        self.assertNotIsInstance(get_storage(), TempFileFileSystemStorage)
+
+
+class TestBatchStatus(BaseTestAsyncDownload):
+    """
+    Phase 2. of many tasks with one request
+    """
+    def test_batch_status(self):
+        task_id = self.phase1_start_creating_file()
+        example_download_task.AsyncResult(task_id).wait(timeout=5, interval=0.5)
+        response = self.client.get(
+            reverse('async_view_batch_status'), {
+                'task_ids': '{},unknown-task-id'.format(task_id),
+            })
+        self.assertEqual(response.status_code, 200)
+        content = self.assertIsJSON(response.content)
+        self.assertEqual(content['tasks'], {
+            task_id: {'ready': True},
+            'unknown-task-id': {'ready': False},
+        })
+
+    def test_no_task_ids(self):
+        response = self.client.get(reverse('async_view_batch_status'))
+        self.assertEqual(response.status_code, 400)
+
+
 class TestAsyncDownload_EAGER(BaseTestAsyncDownload):
     """
     The file is downloaded with one call
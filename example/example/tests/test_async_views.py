@@ -21,6 +21,7 @@ from example.views import ExampleView
 
 from http.client import FORBIDDEN
 
+from django_celery_async_view.cache import get_cache
 from django_celery_async_view.models import TempFile
 
 
@@ -38,8 +39,8 @@ class BaseTestAsyncViews(CeleryTestCase):
                     original_tempfile_count, original_tempfile_ids,
                     expected_to_be_deleted_count)
 
-    def phase1(self):
-        response = self.client.get(self.example_view_url)
+    def phase1(self, params=None):
+        response = self.client.get(self.example_view_url, params or {})
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'django_celery_async_view/loading.html')
         # get task_id from the html
@@ -100,6 +101,65 @@ class TestAsyncViews_NoDB(CeleryTestCaseNoDBMixin, TestAsyncViews):
     pass
 
 
+@override_settings(
+    ASYNC_VIEW_NOTIFICATION_BACKEND='django_celery_async_view.notifications.LocalNotificationBackend')
+class TestAsyncViews_EVENTS(BaseTestAsyncViews):
+    """
+    Phase 2. Server-Sent Events
+    Worker runs in the same process so LocalNotificationBackend can be used
+    """
+    def test_events(self):
+        task_id = self.phase1()
+        response = self.client.get(
+            self.example_view_url, {
+                'task_id': task_id,
+                'events': 'true',
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = b''.join(response.streaming_content).decode('utf-8')
+        self.assertIn('event: ready', events)
+        # Phase 3.
+        response = self.client.get(
+            self.example_view_url, {
+                'task_id': task_id
+            })
+        content = self.assertIsJSON(response.content)
+        self.assertTrue(content['ready'])
+        self.assert_async_view_html(content['html'])
+
+
+@patch('example.views.ExampleView.cache_timeout', 60)
+class TestAsyncViews_CACHE(BaseTestAsyncViews):
+    """
+    Second request gets the cached html in Phase 1.
+    """
+    def setUp(self):
+        super(TestAsyncViews_CACHE, self).setUp()
+        get_cache().clear()
+
+    def test_cache_hit(self):
+        self._test_get_async_view()
+        response = self.client.get(self.example_view_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateNotUsed(response, 'django_celery_async_view/loading.html')
+        self.assert_async_view_html(response.content)
+
+    @patch('example.views.ExampleView.cache_vary_on', ('GET',))
+    def test_cache_vary_on_get(self):
+        task_id = self.phase1({'report': 'a'})
+        example_view_task.AsyncResult(task_id).wait(timeout=5, interval=0.5)
+        # Phase 3. poll url has only task_id
+        response = self.client.get(self.example_view_url, {'task_id': task_id})
+        self.assert_async_view_html(self.assertIsJSON(response.content)['html'])
+        response = self.client.get(self.example_view_url, {'report': 'a'})
+        self.assertTemplateNotUsed(response, 'django_celery_async_view/loading.html')
+        self.assert_async_view_html(response.content)
+        # cached only for report=a
+        self.phase1()
+        self.phase1({'report': 'b'})
+
+
 class TestAsyncViews_EAGER(BaseTestAsyncViews):
     """
     The file is downloaded with one call
@@ -32,6 +32,8 @@ class CeleryTestCase(CeleryTestCaseMixin, SimpleTestCase):
 
     """
     allow_database_queries = True
+    # Django >= 2.2
+    databases = '__all__'
     celery_app = example_celery_app
     celery_concurrency = 4
 
@@ -17,7 +17,7 @@ Including another URLconf
     2. Add a URL to urlpatterns:  url(r'^blog/', include('blog.urls'))
 """
 import example.views
-from django.conf.urls import url
+from django.conf.urls import include, url
 from django.contrib import admin
 
 urlpatterns = [
@@ -40,4 +40,7 @@ urlpatterns = [
     url(r'^example-slow-download/$',
         example.views.ExampleSlowDownloadView.as_view(),
         name='example_slow_download'),
+
+    # BATCH STATUS
+    url(r'^async-view/', include('django_celery_async_view.urls')),
 ]